@@ -1,49 +1,57 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, g, request, jsonify, send_from_directory, send_file
+from contextlib import ExitStack
+from itertools import islice
 from flask_cors import CORS
 import psycopg2
-import bcrypt
 import os
 from dotenv import load_dotenv
 from psycopg2 import errors # Импортируем ошибки psycopg2 для обработки UniqueViolation
-from psycopg2.extras import DictCursor
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
+from psycopg2 import sql
+from psycopg2.extras import DictCursor, execute_values
+from db import get_db_connection, DatabaseUnavailable, format_lsn, parse_lsn, write_position
+from tokens import issue_token, require_role
+from user_cache import profile_cache
+from passwords import (
+    HashingOverloaded, check_password, hash_password, hashing_stats, needs_rehash,
+    pop_request_hash_time, schedule_rehash
+)
+import metrics
+from catalog_events import (
+    TooManySubscribers, iter_sse, notify_products, notify_reload, subscribe, subscriber_limit, unsubscribe
+)
+from catalog_cache import (
+    ResponseCache, bump_catalog_version, catalog_version, catalog_write_lsn, make_etag, query_key
+)
+from product_io import (
+    EXPORT_MIMETYPES, IMPORT_FORMATS, CopyStream, ImportResult,
+    gzip_chunks, iter_copy_lines, iter_export_chunks, iter_valid_products, validate_product
+)
+from green import is_green, run_blocking
+from json_provider import FastJSONProvider
 from datetime import datetime
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from product_search import SEARCH_SQL, parse_search_args, search_params
+from thumbnails import (
+    THUMBNAIL_DEFAULT_SIZE, THUMBNAIL_FORMATS, THUMBNAIL_SIZES, THUMBNAIL_URL_SQL,
+    ThumbnailError, get_thumbnail
+)
+from reports import render_booked_pdf, warm_up as warm_up_reports
+from report_jobs import booked_set_key, is_valid_job_id, job_status, report_path, submit_booked_report
 
 # Загружаем переменные окружения из файла .env
 load_dotenv()
 
 app = Flask(__name__)
+# jsonify() через orjson (если установлен): быстрее, Decimal -> число, без отступов в debug
+app.json = FastJSONProvider(app)
 # Настраиваем CORS (Упрощенная версия для отладки)
-CORS(app)
-# --- Настройки подключения к БД (лучше через переменные окружения) ---
-DB_NAME = os.getenv("DB_NAME", "Lombard")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASSWORD = os.getenv("DB_PASSWORD") # Добавляем загрузку пароля из .env
-DB_HOST = os.getenv("DB_HOST", "localhost") # или другой хост
-DB_PORT = os.getenv("DB_PORT", "5432")     # или другой порт
-
-def get_db_connection():
-    """Устанавливает соединение с базой данных PostgreSQL."""
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        return conn
-    except psycopg2.Error as e:
-        print(f"Ошибка подключения к базе данных: {e}")
-        # В реальном приложении здесь лучше логировать ошибку
-        return None
+# X-DB-Position должен быть виден клиенту: он возвращает его в следующих запросах
+CORS(app, expose_headers=['X-DB-Position'])
+# Регистрируем шрифт и собираем стили PDF при старте процесса, а не на первом запросе отчета
+if os.getenv("PDF_WARM_UP", "1") == "1":
+    warm_up_reports()
+# Настройки подключения к БД и пул соединений находятся в db.py
+# Задержка по маршрутам, время SQL и Server-Timing (см. metrics.py)
+metrics.init_app(app)
 
 # --- Эндпоинты API ---
 # Добавьте в конец файла или перед другими маршрутами:
@@ -60,6 +68,113 @@ def index():
         ]
     })
 
+def _collect_cache_metrics():
+    """Счётчики пула хэширования и кэша профилей на момент запроса /metrics."""
+    hashing = hashing_stats()
+    profiles = profile_cache.stats()
+    return [
+        ("auth_hash_calls_total", "counter", "Выполненные хэширования/проверки паролей", hashing["calls"]),
+        ("auth_hash_rejected_total", "counter", "Отказы пула хэширования (503)", hashing["rejected"]),
+        ("auth_hash_seconds_total", "counter", "Суммарное время хэширования паролей", hashing["seconds_total"]),
+        ("profile_cache_hits_total", "counter", "Попадания в кэш профилей", profiles["hits"]),
+        ("profile_cache_misses_total", "counter", "Промахи кэша профилей", profiles["misses"]),
+        ("profile_cache_size", "gauge", "Записей в кэше профилей", profiles["size"]),
+    ]
+
+
+metrics.register_collector(_collect_cache_metrics)
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Метрики воркера в формате Prometheus. Если задан METRICS_TOKEN, нужен Bearer с ним."""
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"message": "Метрики отключены"}), 404
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({"message": "Требуется авторизация"}), 401
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _auth_overloaded_response():
+    """503 при перегрузке пула bcrypt: клиент может повторить запрос позже."""
+    response = jsonify({"message": "Сервер перегружен, попробуйте войти через несколько секунд"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+@app.after_request
+def add_hash_timing(response):
+    """Server-Timing с временем bcrypt, если запрос хэшировал пароль."""
+    seconds = pop_request_hash_time()
+    if seconds:
+        response.headers.add('Server-Timing', f'bcrypt;dur={seconds * 1000:.1f}')
+    return response
+
+
+# --- Чтение с реплик: клиент видит свои записи ---
+DB_POSITION_HEADER = 'X-DB-Position' # Позиция WAL последней записи клиента (см. db.write_position)
+
+
+def _remember_write(conn):
+    """
+    Позиция WAL только что зафиксированной записи (0, если реплик нет).
+
+    Уходит клиенту в заголовке X-DB-Position: пока клиент его присылает,
+    его чтения не попадут на реплику, где этой записи ещё нет.
+    """
+    try:
+        position = write_position(conn)
+    except psycopg2.Error as e:
+        # Запись уже зафиксирована — ответ не портим, клиент лишь может прочитать реплику с задержкой
+        print(f"Не удалось получить позицию WAL после записи: {e}")
+        return 0
+    if position:
+        g.db_position = position
+    return position
+
+
+def _client_position():
+    """Позиция WAL, которую прислал клиент (0 — нет или некорректная)."""
+    header = request.headers.get(DB_POSITION_HEADER)
+    if not header:
+        return 0
+    try:
+        return parse_lsn(header)
+    except ValueError:
+        return 0
+
+
+def _catalog_position():
+    """Позиция, до которой реплика должна догнать основной сервер для чтения каталога."""
+    # Позиция последней записи в каталог защищает общий кэш ответов от старых данных с реплики
+    return max(_client_position(), catalog_write_lsn())
+
+
+@app.after_request
+def add_db_position(response):
+    """X-DB-Position в ответах на запросы, которые что-то записали."""
+    position = g.get('db_position')
+    if position:
+        response.headers[DB_POSITION_HEADER] = format_lsn(position)
+    return response
+
+
+# Сообщения для нарушений уникальности по имени ограничения (индексы из migrations/0002)
+UNIQUE_CONSTRAINT_MESSAGES = {
+    'users_username_key': "Пользователь с таким логином уже существует",
+    'users_email_key': "Пользователь с таким email уже существует",
+}
+
+# Регистрация одним запросом: занятый логин -> ни одной строки, занятый email -> UniqueViolation
+REGISTER_USER_SQL = """
+    INSERT INTO users (username, password_hash, role, full_name, phone_number, email)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (username) DO NOTHING
+    RETURNING id
+"""
+
+
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -79,64 +194,73 @@ def register():
     # TODO: Более строгая валидация email, телефона и т.д. по желанию
     # ------------------------
 
-    conn = None
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
-
-        with conn.cursor() as cur:
-            # 1. Проверить, не занят ли username (оставляем)
-            cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-            if cur.fetchone():
-                return jsonify({"message": "Пользователь с таким логином уже существует"}), 409
-
-            # 2. Хэшировать пароль (оставляем)
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            hashed_password_str = hashed_password.decode('utf-8')
-
-            # 3. Сохранить нового пользователя в БД (с новыми полями)
-            sql_insert = """
-                INSERT INTO users (username, password_hash, role, full_name, phone_number, email)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            cur.execute(sql_insert, (
-                username, 
-                hashed_password_str, 
+        # 1. Дешёвая проверка по индексам до bcrypt: занятые логин/email не тратят CPU на хэш
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT username = %s, email = %s FROM users WHERE username = %s OR email = %s LIMIT 2",
+                (username, email, username, email)
+            )
+            taken = cur.fetchall()
+        # Соединение возвращено в пул до хэширования
+        if any(username_taken for username_taken, _ in taken):
+            return jsonify({"message": UNIQUE_CONSTRAINT_MESSAGES['users_username_key']}), 409
+        if taken:
+            return jsonify({"message": UNIQUE_CONSTRAINT_MESSAGES['users_email_key']}), 409
+
+        # 2. Хэшировать пароль (в ограниченном пуле потоков, см. passwords.py)
+        hashed_password_str = hash_password(password)
+
+        # 3. Один INSERT: гонку с параллельной регистрацией решают уникальные индексы
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(REGISTER_USER_SQL, (
+                username,
+                hashed_password_str,
                 'user', # Роль по умолчанию
-                full_name, 
-                phone_number, 
+                full_name,
+                phone_number,
                 email
             ))
-            conn.commit() 
-
-            return jsonify({"message": "Пользователь успешно зарегистрирован"}), 201
-
-    except errors.UniqueViolation as e: # Обрабатываем ошибку уникальности (для email или username)
-        if conn:
-            conn.rollback()
-        # Проверяем, на какое поле сработал unique constraint
-        # Это не самый надежный способ, зависит от сообщения об ошибке БД
-        error_detail = str(e).lower()
-        if 'email' in error_detail:
-             return jsonify({"message": "Пользователь с таким email уже существует"}), 409
-        elif 'username' in error_detail: # На случай, если проверка fetchone() не сработала
-            return jsonify({"message": "Пользователь с таким логином уже существует"}), 409
-        else:
+            created = cur.fetchone()
+            conn.commit()
+            _remember_write(conn) # Профиль нового пользователя читается сразу после регистрации
+        if created is None:
+            # Логин заняли между проверкой и вставкой
+            return jsonify({"message": UNIQUE_CONSTRAINT_MESSAGES['users_username_key']}), 409
+
+        return jsonify({"message": "Пользователь успешно зарегистрирован"}), 201
+
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    except HashingOverloaded:
+        return _auth_overloaded_response()
+    except errors.UniqueViolation as e: # Email заняли между проверкой и вставкой
+        # Откат транзакции выполняет get_db_connection при возврате соединения в пул
+        message = UNIQUE_CONSTRAINT_MESSAGES.get(e.diag.constraint_name)
+        if message is None:
             print(f"Ошибка уникальности при регистрации: {e}")
-            return jsonify({"message": "Ошибка уникальности данных при регистрации"}), 409
+            message = "Ошибка уникальности данных при регистрации"
+        return jsonify({"message": message}), 409
 
     except psycopg2.Error as e: # Обработка других ошибок БД
-        if conn:
-            conn.rollback()
         print(f"Ошибка при регистрации: {e}")
         return jsonify({"message": "Ошибка на сервере при регистрации"}), 500
     except Exception as e: # Обработка прочих ошибок
         print(f"Неожиданная ошибка при регистрации: {e}")
         return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+def _password_hash_saver(user_id, old_hash):
+    """Сохранение пересчитанного хэша; не перезаписывает пароль, если его успели сменить."""
+    def save(new_hash):
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                (new_hash, user_id, old_hash)
+            )
+            conn.commit()
+        profile_cache.invalidate(user_id) # Любая запись в users сбрасывает кэш профиля
+    return save
+
 
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -147,32 +271,35 @@ def login():
     if not username or not password:
         return jsonify({"message": "Требуется логин и пароль"}), 400
 
-    conn = None
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
-
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        
-        # Ищем пользователя по имени пользователя и получаем ID, хэш пароля (password_hash) и РОЛЬ
-        cursor.execute("SELECT id, password_hash, role FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
-        
-        cursor.close()
-        # conn.close() # Закрывать соединение здесь преждевременно, если проверка пароля не удалась
-        
+        with get_db_connection() as conn, conn.cursor(cursor_factory=DictCursor) as cursor:
+            # Ищем пользователя по имени пользователя и получаем ID, хэш пароля (password_hash) и РОЛЬ
+            cursor.execute("SELECT id, password_hash, role FROM users WHERE username = %s", (username,))
+            user = cursor.fetchone()
+        # Соединение уже вернулось в пул — bcrypt не держит его занятым
+
         # Проверяем, найден ли пользователь и совпадает ли пароль
-        if user and bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-            conn.close() # Закрываем соединение после успешной проверки
-            # Пароль верный, возвращаем ID пользователя и его РОЛЬ
-            return jsonify({'message': 'Login successful', 'user_id': user['id'], 'role': user['role']}), 200
+        if user and check_password(password, user['password_hash']):
+            # Хэш устарел относительно политики — пересчитываем в фоне, не задерживая ответ
+            if needs_rehash(user['password_hash']):
+                schedule_rehash(password, _password_hash_saver(user['id'], user['password_hash']))
+            # Пароль верный, возвращаем ID пользователя, его РОЛЬ и подписанный токен доступа
+            token, expires_in = issue_token(user['id'], user['role'])
+            return jsonify({
+                'message': 'Login successful',
+                'user_id': user['id'],
+                'role': user['role'],
+                'token': token,
+                'expires_in': expires_in
+            }), 200
         else:
-            if conn:
-                conn.close() # Закрываем соединение, если пользователь не найден или пароль неверный
             # Неверные учетные данные
             return jsonify({"message": "Неверный логин или пароль"}), 401 # 401 Unauthorized
 
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    except HashingOverloaded:
+        return _auth_overloaded_response()
     except psycopg2.Error as e:
         print(f"Ошибка при входе: {e}")
         return jsonify({"message": "Ошибка на сервере при входе"}), 500
@@ -181,47 +308,176 @@ def login():
         return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
 
 # --- Новый эндпоинт для получения списка товаров ---
+# Поля товара, которые можно запросить через ?fields=
+PRODUCT_FIELDS = ('id', 'name', 'price', 'is_booked', 'image_url')
+PRODUCTS_PAGE_DEFAULT = 50
+PRODUCTS_PAGE_MAX = 500
+
+
+def _parse_bool_arg(value):
+    """Разбирает булев query-параметр ('true'/'false', '1'/'0')."""
+    lowered = value.strip().lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValueError(value)
+
+
+def _parse_products_query(args):
+    """
+    Разбирает параметры списка товаров.
+
+    Возвращает (fields, limit, cursor, where, params), а при ошибке валидации
+    выбрасывает ValueError с сообщением для клиента.
+    """
+    # Проекция полей: id нужен всегда, по нему строится курсор
+    fields = list(PRODUCT_FIELDS)
+    if args.get('fields'):
+        requested = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in requested if f not in PRODUCT_FIELDS]
+        if unknown:
+            raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+        fields = ['id'] + [f for f in PRODUCT_FIELDS if f in requested and f != 'id']
+
+    try:
+        limit = int(args.get('limit', PRODUCTS_PAGE_DEFAULT))
+    except ValueError:
+        raise ValueError("Параметр limit должен быть целым числом")
+    if limit < 1 or limit > PRODUCTS_PAGE_MAX:
+        raise ValueError(f"Параметр limit должен быть от 1 до {PRODUCTS_PAGE_MAX}")
+
+    cursor = None
+    if args.get('cursor'):
+        try:
+            cursor = int(args['cursor'])
+        except ValueError:
+            raise ValueError("Некорректный курсор")
+
+    where = []
+    params = []
+    if cursor is not None:
+        # Keyset-пагинация: продолжаем после последнего id предыдущей страницы
+        where.append("id > %s")
+        params.append(cursor)
+    if args.get('is_booked'):
+        try:
+            params.append(_parse_bool_arg(args['is_booked']))
+        except ValueError:
+            raise ValueError("Параметр is_booked должен быть true или false")
+        where.append("is_booked = %s")
+    for arg_name, op in (('min_price', '>='), ('max_price', '<=')):
+        if args.get(arg_name):
+            try:
+                params.append(float(args[arg_name]))
+            except ValueError:
+                raise ValueError(f"Параметр {arg_name} должен быть числом")
+            where.append(f"price {op} %s")
+    if args.get('name_prefix'):
+        # Экранируем спецсимволы LIKE, чтобы префикс искался буквально
+        prefix = args['name_prefix'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where.append("name ILIKE %s")
+        params.append(prefix + '%')
+
+    return fields, limit, cursor, where, params
+
+
+def _catalog_page_query(fields, where):
+    """
+    Страница каталога, собранная в JSON самим PostgreSQL.
+
+    Вместе с image_url отдаётся thumbnail_url — адрес миниатюры (см. thumbnails.py).
+
+    Строки не превращаются в словари Python: json_agg отдаёт готовое тело
+    {"items": [...], "next_cursor": ...} одной строкой. Берётся limit + 1
+    строка, чтобы понять, есть ли следующая страница.
+    Параметры: params условий where, затем limit + 1, limit, limit.
+    """
+    pairs = [sql.SQL("{}, {}").format(sql.Literal(f), sql.Identifier(f)) for f in fields]
+    if 'image_url' in fields:
+        pairs.append(sql.SQL("'thumbnail_url', " + THUMBNAIL_URL_SQL))
+    item = sql.SQL("json_build_object({})").format(sql.SQL(', ').join(pairs))
+    return sql.SQL("""
+        WITH page AS (
+            SELECT {fields} FROM products {where} ORDER BY id LIMIT %s
+        ), shown AS (
+            SELECT * FROM page ORDER BY id LIMIT %s
+        )
+        SELECT json_build_object(
+            'items', COALESCE((SELECT json_agg({item} ORDER BY id) FROM shown), '[]'::json),
+            'next_cursor', CASE WHEN (SELECT count(*) FROM page) > %s THEN (SELECT max(id) FROM shown) END
+        )::text
+    """).format(
+        fields=sql.SQL(', ').join(sql.Identifier(f) for f in fields),
+        where=sql.SQL("WHERE " + " AND ".join(where)) if where else sql.SQL(''),
+        item=item
+    )
+
+
+# Кэш сериализованных страниц каталога (ключ — query-параметры)
+_products_cache = ResponseCache()
+
+
+def _catalog_response(body, etag, status=200):
+    """Ответ каталога с ETag; Cache-Control: no-cache заставляет браузер перепроверять его."""
+    response = app.response_class(body, status=status, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @app.route('/api/products', methods=['GET'])
 def get_products():
-    conn = None
+    """
+    Страница каталога.
+
+    Параметры: limit, cursor (id последнего товара предыдущей страницы),
+    is_booked, min_price, max_price, name_prefix, fields (через запятую).
+    Ответ: {"items": [...], "next_cursor": id или null}.
+    Ответ снабжается ETag от версии каталога: If-None-Match даёт 304 без запроса к БД.
+    """
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
-
-        with conn.cursor() as cur:
-            # Выбираем нужные поля из таблицы products
-            cur.execute("SELECT id, name, price, is_booked, image_url FROM products ORDER BY id") # Добавим сортировку по ID
-            products_raw = cur.fetchall()
-
-            # Преобразуем результат (список кортежей) в список словарей
-            products_list = []
-            if products_raw:
-                # Получаем имена колонок из описания курсора
-                colnames = [desc[0] for desc in cur.description]
-                for row in products_raw:
-                    product_dict = dict(zip(colnames, row))
-                    # Преобразуем Decimal в строку или float для JSON-сериализации
-                    if 'price' in product_dict and product_dict['price'] is not None:
-                         product_dict['price'] = float(product_dict['price']) # или str()
-                    products_list.append(product_dict)
-
-            return jsonify(products_list), 200
+        fields, limit, cursor, where, params = _parse_products_query(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # Версию читаем ДО запроса к БД: если товары изменятся во время запроса,
+    # версия к моменту следующего чтения уже будет другой и устаревший ответ не отдастся
+    version = catalog_version()
+    cache_key = query_key(request.args)
+    etag = make_etag(version, cache_key)
+    if request.if_none_match.contains(etag):
+        return _catalog_response(b'', etag, 304)
+
+    body = _products_cache.get(version, cache_key)
+    if body is not None:
+        return _catalog_response(body, etag)
 
+    params.extend([limit + 1, limit, limit])
+
+    try:
+        # Каталог читается с реплики, если она уже видит все записи, вошедшие в эту версию
+        with get_db_connection(readonly=True, min_lsn=_catalog_position()) as conn, conn.cursor() as cur:
+            cur.execute(_catalog_page_query(fields, where), params)
+            # Тело ответа целиком собрано в PostgreSQL (json_agg) — словари Python не создаются
+            body = cur.fetchone()[0].encode('utf-8')
+
+        _products_cache.put(version, cache_key, body)
+        return _catalog_response(body, etag)
+
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
     except psycopg2.Error as e:
         print(f"Ошибка при получении списка товаров: {e}")
         return jsonify({"message": "Ошибка на сервере при получении товаров"}), 500
     except Exception as e:
         print(f"Неожиданная ошибка при получении списка товаров: {e}")
         return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 # --- Новый эндпоинт для добавления товара ---
 @app.route('/api/products', methods=['POST'])
+@require_role('admin')
 def add_product():
-    conn = None
     try:
         # Получаем данные из JSON тела запроса
         data = request.get_json()
@@ -229,139 +485,487 @@ def add_product():
         price = data.get('price')
         image_url = data.get('image_url') # Может быть пустым
 
-        # Простая валидация
-        if not name or price is None:
-            return jsonify({"message": "Необходимо указать название и цену товара"}), 400
-
-        # Проверка, что цена является числом
+        # Валидация (те же правила использует импорт каталога)
         try:
-            price = float(price) # Попробуем преобразовать в число
-            if price < 0:
-                 return jsonify({"message": "Цена не может быть отрицательной"}), 400
-        except ValueError:
-            return jsonify({"message": "Цена должна быть числом"}), 400
+            name, price, image_url = validate_product(name, price, image_url)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
 
         # Подключение к БД
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
-        cursor = conn.cursor(cursor_factory=DictCursor)
-
-        # Вставляем новый товар
-        # is_booked по умолчанию FALSE (если не указано иное в схеме БД)
-        cursor.execute(
-            "INSERT INTO products (name, price, image_url) VALUES (%s, %s, %s) RETURNING id",
-            (name, price, image_url or None) # Используем None, если image_url пустой
-        )
-        new_product_id = cursor.fetchone()['id']
-        
-        conn.commit() # Фиксируем изменения
-        cursor.close()
-        
+        with get_db_connection() as conn, conn.cursor(cursor_factory=DictCursor) as cursor:
+            # Вставляем новый товар
+            # is_booked по умолчанию FALSE (если не указано иное в схеме БД)
+            cursor.execute(
+                "INSERT INTO products (name, price, image_url) VALUES (%s, %s, %s) RETURNING id",
+                (name, price, image_url) # validate_product заменяет пустой image_url на None
+            )
+            new_product_id = cursor.fetchone()['id']
+            notify_products(cursor, 'insert', [new_product_id]) # Уйдёт подписчикам после COMMIT
+
+            conn.commit() # Фиксируем изменения
+            bump_catalog_version(_remember_write(conn)) # Каталог изменился — сбрасываем ETag и кэш
+
         return jsonify({"message": "Товар успешно добавлен", "product_id": new_product_id}), 201 # 201 Created
 
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
     except psycopg2.Error as e:
+        # Незафиксированная транзакция откатывается при возврате соединения в пул
         print(f"Ошибка базы данных при добавлении товара: {e}")
-        if conn:
-            conn.rollback() # Откатываем изменения в случае ошибки БД
         return jsonify({"message": "Ошибка базы данных при добавлении товара"}), 500
     except Exception as e:
         print(f"Неожиданная ошибка при добавлении товара: {e}")
-        if conn:
-            conn.rollback()
         return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+# --- Поиск товаров по названию ---
+_search_cache = ResponseCache()
+
+
+@app.route('/api/products/search', methods=['GET'])
+def search_products():
+    """
+    Поиск по названию: q (от 2 символов), limit (по умолчанию 20, не больше 100).
+
+    Находит словоформы («кольца» -> «кольцо»), подстроки и слова с опечатками;
+    результаты упорядочены по релевантности. Ответ: {"items": [...]}.
+    Как и каталог, снабжается ETag от версии каталога.
+    """
+    try:
+        q, limit = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    version = catalog_version()
+    cache_key = f"{limit}|{q}" # q уже нормализован: лишние пробелы убраны
+    etag = make_etag(version, 'search:' + cache_key)
+    if request.if_none_match.contains(etag):
+        return _catalog_response(b'', etag, 304)
+    body = _search_cache.get(version, cache_key)
+    if body is not None:
+        return _catalog_response(body, etag)
+
+    try:
+        with get_db_connection(readonly=True, min_lsn=_catalog_position()) as conn, conn.cursor() as cur:
+            cur.execute(SEARCH_SQL, search_params(q, limit))
+            body = cur.fetchone()[0].encode('utf-8')
+        _search_cache.put(version, cache_key, body)
+        return _catalog_response(body, etag)
+
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    except psycopg2.Error as e:
+        print(f"Ошибка при поиске товаров: {e}")
+        return jsonify({"message": "Ошибка на сервере при поиске товаров"}), 500
+    except Exception as e:
+        print(f"Неожиданная ошибка при поиске товаров: {e}")
+        return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
+
+
+# --- Миниатюры изображений товаров ---
+THUMBNAIL_IMMUTABLE_MAX_AGE = 365 * 24 * 3600 # Адрес с актуальной версией никогда не меняет содержимое
+THUMBNAIL_STALE_MAX_AGE = 300 # Запрошена устаревшая версия — отдаём актуальную картинку ненадолго
+
+
+def _thumbnail_format():
+    """WebP, если клиент явно его принимает, иначе JPEG; ?format= переопределяет."""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt
+    accepts_webp = any(value == 'image/webp' and quality > 0 for value, quality in request.accept_mimetypes)
+    return 'webp' if accepts_webp else 'jpeg'
+
+
+@app.route('/api/products/<int:product_id>/thumbnail', methods=['GET'])
+def get_product_thumbnail(product_id):
+    """
+    Миниатюра изображения товара: size=s|m, v — версия URL из thumbnail_url.
+
+    Готовые миниатюры отдаются с диска без запроса к БД; ETag — sha256 содержимого.
+    """
+    size = request.args.get('size', THUMBNAIL_DEFAULT_SIZE)
+    if size not in THUMBNAIL_SIZES:
+        return jsonify({"message": f"Параметр size должен быть одним из: {', '.join(THUMBNAIL_SIZES)}"}), 400
+    fmt = _thumbnail_format()
+    if fmt not in THUMBNAIL_FORMATS:
+        return jsonify({"message": f"Параметр format должен быть одним из: {', '.join(THUMBNAIL_FORMATS)}"}), 400
+    version = request.args.get('v')
+
+    def load_image_url():
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT image_url FROM products WHERE id = %s", (product_id,))
+            row = cur.fetchone()
+        if row is None:
+            raise LookupError("Товар не найден")
+        return row[0]
+
+    try:
+        path, digest, current_version = get_thumbnail(product_id, version, size, fmt, load_image_url)
+    except LookupError as e:
+        return jsonify({"message": str(e)}), 404
+    except ThumbnailError as e:
+        print(f"Ошибка при создании миниатюры товара {product_id}: {e}")
+        return jsonify({"message": "Не удалось получить изображение товара"}), 502
+    except TimeoutError:
+        response = jsonify({"message": "Миниатюра еще готовится, повторите запрос"})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    except Exception as e:
+        print(f"Неожиданная ошибка при создании миниатюры товара {product_id}: {e}")
+        return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
+
+    max_age = THUMBNAIL_IMMUTABLE_MAX_AGE if current_version == version else THUMBNAIL_STALE_MAX_AGE
+    if request.if_none_match.contains(digest):
+        response = app.response_class(status=304)
+    else:
+        response = send_file(path, mimetype=THUMBNAIL_FORMATS[fmt][1], conditional=False, etag=False)
+    response.set_etag(digest)
+    response.headers['Cache-Control'] = f"public, max-age={max_age}" + (", immutable" if max_age == THUMBNAIL_IMMUTABLE_MAX_AGE else "")
+    response.headers['Vary'] = 'Accept' # Формат зависит от заголовка Accept
+    return response
+
+
+# --- Живые обновления каталога (SSE) ---
+@app.route('/api/products/stream', methods=['GET'])
+def stream_products():
+    """
+    Server-Sent Events с изменениями каталога (insert / update / delete / reload).
+
+    Все подписчики воркера получают события от одного LISTEN-соединения,
+    см. catalog_events.py. После подключения клиент сам загружает каталог
+    через /api/products и дальше применяет только дельты.
+
+    В режиме sync поток занял бы весь воркер до таймаута gunicorn — отвечаем
+    503, и клиент перечитывает каталог периодически (см. catalogStream.js).
+    """
+    if subscriber_limit() == 0:
+        response = jsonify({"message": "Живые обновления недоступны в режиме WORKER_MODE=sync"})
+        response.headers['Retry-After'] = '300'
+        return response, 503
+    try:
+        subscriber = subscribe()
+    except TooManySubscribers as e:
+        response = jsonify({"message": str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    response = app.response_class(iter_sse(subscriber), mimetype='text/event-stream')
+    # Если ответ закроют до первого чтения, finally генератора не выполнится — снимаем подписку и здесь
+    response.call_on_close(lambda: unsubscribe(subscriber))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Прокси не должен копить события в буфере
+    return response
+
+
+# --- Массовый импорт товаров (CSV / NDJSON) ---
+IMPORT_INSERT_BATCH = 1000  # Строк в одном INSERT, когда COPY недоступен (режим gevent)
+
+
+def _load_import_rows(cur, stream, fmt, result):
+    """Заливает валидные строки во временную таблицу products_import."""
+    if not is_green():
+        cur.copy_expert(
+            "COPY products_import (name, price, image_url) FROM STDIN WITH (FORMAT csv)",
+            CopyStream(iter_copy_lines(stream, fmt, result))
+        )
+        return
+    # psycopg2 с колбэком ожидания (psycogreen) не поддерживает COPY — вставляем пачками
+    rows = iter_valid_products(stream, fmt, result)
+    while True:
+        batch = list(islice(rows, IMPORT_INSERT_BATCH))
+        if not batch:
+            break
+        execute_values(cur, "INSERT INTO products_import (name, price, image_url) VALUES %s", batch,
+                       page_size=IMPORT_INSERT_BATCH)
+
+
+@app.route('/api/products/import', methods=['POST'])
+@require_role('admin')
+def import_products():
+    """
+    Загружает товары потоком через COPY FROM STDIN во временную таблицу.
+
+    Формат берётся из Content-Type (text/csv или application/x-ndjson)
+    либо из ?format=csv|ndjson. У CSV должна быть строка заголовка
+    name,price,image_url. Невалидные строки пропускаются и попадают в errors.
+    """
+    fmt = request.args.get('format') or IMPORT_FORMATS.get(request.mimetype)
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"message": "Поддерживаются форматы text/csv и application/x-ndjson"}), 415
+
+    result = ImportResult()
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            # Промежуточная таблица живёт до конца транзакции; типы — как у products
+            cur.execute("""
+                CREATE TEMP TABLE products_import (
+                    name TEXT NOT NULL,
+                    price NUMERIC(12, 2) NOT NULL,
+                    image_url TEXT
+                ) ON COMMIT DROP
+            """)
+            _load_import_rows(cur, request.stream, fmt, result)
+            cur.execute("""
+                INSERT INTO products (name, price, image_url)
+                SELECT name, price, image_url FROM products_import
+            """)
+            inserted = cur.rowcount
+            if inserted:
+                notify_reload(cur) # Тысячи строк не шлём по одной — клиенты перечитают каталог
+            conn.commit() # Все строки файла фиксируются одной транзакцией
+            position = _remember_write(conn) if inserted else 0
+        if inserted:
+            bump_catalog_version(position) # Каталог изменился — сбрасываем ETag и кэш
+
+        return jsonify({
+            "inserted": inserted,
+            "rejected": result.rejected,
+            "errors": result.errors
+        }), 200
+
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    except psycopg2.Error as e:
+        print(f"Ошибка базы данных при импорте товаров: {e}")
+        return jsonify({"message": "Ошибка базы данных при импорте товаров"}), 500
+    except Exception as e:
+        print(f"Неожиданная ошибка при импорте товаров: {e}")
+        return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
+
+# --- Потоковая выгрузка каталога (CSV / NDJSON) ---
+EXPORT_ITERSIZE = 2000  # Сколько строк серверный курсор забирает из БД за раз
+
+
+@app.route('/api/products/export', methods=['GET'])
+def export_products():
+    """
+    Выгружает весь каталог потоком: ?format=csv (по умолчанию) или ndjson.
+
+    Строки читаются именованным (серверным) курсором порциями по EXPORT_ITERSIZE,
+    поэтому память воркера не растёт с размером каталога. При Accept-Encoding: gzip
+    поток сжимается на лету.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify({"message": "Поддерживаются форматы csv и ndjson"}), 400
+
+    # Соединение берём до начала ответа, чтобы ошибка подключения вернулась обычным 500.
+    # Вернётся в пул оно при закрытии ответа (в том числе если клиент оборвал загрузку).
+    resources = ExitStack()
+    try:
+        conn = resources.enter_context(get_db_connection())
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+
+    def generate():
+        try:
+            with conn.cursor(name='products_export') as cur:
+                cur.itersize = EXPORT_ITERSIZE
+                cur.execute("SELECT id, name, price, is_booked, image_url FROM products ORDER BY id")
+                yield from iter_export_chunks(cur, fmt)
+        except psycopg2.Error as e:
+            # Заголовки уже отправлены — остаётся только оборвать поток
+            print(f"Ошибка базы данных при выгрузке каталога: {e}")
+            raise
+
+    chunks = generate()
+    headers = {
+        'Content-Disposition': f'attachment; filename="products_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{fmt}"',
+        'Vary': 'Accept-Encoding',
+    }
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+
+    response = app.response_class(chunks, mimetype=EXPORT_MIMETYPES[fmt], headers=headers)
+    response.call_on_close(resources.close)
+    return response
+
+def _set_booked(cur, product_id, booked):
+    """
+    Атомарно меняет is_booked товара одним условным UPDATE.
+
+    Возвращает 'ok', 'conflict' (товар уже в нужном состоянии) или 'not_found'.
+    Два параллельных бронирования не могут пройти оба: второе UPDATE
+    дождётся блокировки строки, перепроверит условие и ничего не обновит.
+    """
+    cur.execute(
+        "UPDATE products SET is_booked = %s WHERE id = %s AND is_booked = %s RETURNING id",
+        (booked, product_id, not booked)
+    )
+    if cur.fetchone() is not None:
+        return 'ok'
+    # Редкий путь: отличаем «нет товара» от «уже в этом состоянии»
+    cur.execute("SELECT 1 FROM products WHERE id = %s", (product_id,))
+    return 'conflict' if cur.fetchone() is not None else 'not_found'
+
 
 # --- Новый эндпоинт для бронирования товара ---
 @app.route('/api/products/<int:product_id>/book', methods=['PUT'])
 def book_product(product_id):
-    conn = None
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
-
-        with conn.cursor() as cur:
-            # Проверяем, существует ли товар и не забронирован ли он уже
-            cur.execute("SELECT is_booked FROM products WHERE id = %s", (product_id,))
-            product_status = cur.fetchone()
-
-            if product_status is None:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            # Одна условная операция: обновится, только если товар есть и ещё не забронирован
+            result = _set_booked(cur, product_id, True)
+            if result == 'not_found':
                 return jsonify({"message": "Товар не найден"}), 404 # Not Found
-            
-            if product_status[0] is True: # Если is_booked уже True
+            if result == 'conflict':
                 return jsonify({"message": "Товар уже забронирован"}), 409 # Conflict
+            notify_products(cur, 'update', [product_id])
 
-            # Обновляем статус is_booked на TRUE
-            cur.execute("UPDATE products SET is_booked = TRUE WHERE id = %s", (product_id,))
             conn.commit() # Подтверждаем транзакцию
+            bump_catalog_version(_remember_write(conn)) # Каталог изменился — сбрасываем ETag и кэш
             
             # Возвращаем сообщение об успехе
             return jsonify({"message": f"Товар {product_id} успешно забронирован"}), 200
 
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
     except psycopg2.Error as e:
-        if conn:
-            conn.rollback()
         print(f"Ошибка при бронировании товара {product_id}: {e}")
         return jsonify({"message": "Ошибка на сервере при бронировании"}), 500
     except Exception as e:
         print(f"Неожиданная ошибка при бронировании товара {product_id}: {e}")
         return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 # --- Новый эндпоинт для СНЯТИЯ брони товара ---
 @app.route('/api/products/<int:product_id>/unbook', methods=['PUT'])
 def unbook_product(product_id):
-    conn = None
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
-
-        with conn.cursor() as cur:
-            # Проверяем, существует ли товар и забронирован ли он
-            cur.execute("SELECT is_booked FROM products WHERE id = %s", (product_id,))
-            product_status = cur.fetchone()
-
-            if product_status is None:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            result = _set_booked(cur, product_id, False)
+            if result == 'not_found':
                 return jsonify({"message": "Товар не найден"}), 404 # Not Found
-            
-            if product_status[0] is False: # Если is_booked уже False
+            if result == 'conflict':
                 return jsonify({"message": "Товар не был забронирован"}), 409 # Conflict
+            notify_products(cur, 'update', [product_id])
 
-            # Обновляем статус is_booked на FALSE
-            cur.execute("UPDATE products SET is_booked = FALSE WHERE id = %s", (product_id,))
             conn.commit() # Подтверждаем транзакцию
+            bump_catalog_version(_remember_write(conn)) # Каталог изменился — сбрасываем ETag и кэш
             
             # Возвращаем сообщение об успехе
             return jsonify({"message": f"Бронь с товара {product_id} снята"}), 200
 
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
     except psycopg2.Error as e:
-        if conn:
-            conn.rollback()
         print(f"Ошибка при снятии брони с товара {product_id}: {e}")
         return jsonify({"message": "Ошибка на сервере при снятии брони"}), 500
     except Exception as e:
         print(f"Неожиданная ошибка при снятии брони с товара {product_id}: {e}")
         return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+# --- Массовое бронирование / снятие брони ---
+BULK_BOOKING_MAX_IDS = 500
+PRODUCT_ID_MAX = 2 ** 31 - 1 # products.id — SERIAL (int4): больших id в таблице быть не может
+
+# Один set-based запрос на всю пачку id. Строки блокируются в порядке id
+# (FOR UPDATE ... ORDER BY), поэтому пересекающиеся пачки не дают взаимоблокировок.
+# Подзапрос к products в итоговом SELECT видит снимок до UPDATE и нужен
+# только для того, чтобы отличить «уже в этом состоянии» от «не найден».
+BULK_SET_BOOKED_SQL = """
+    WITH req AS (
+        SELECT DISTINCT unnest(%(ids)s::int[]) AS id
+    ),
+    locked AS (
+        SELECT p.id FROM products p JOIN req ON req.id = p.id
+        WHERE p.is_booked = %(old)s
+        ORDER BY p.id
+        FOR UPDATE OF p
+    ),
+    upd AS (
+        UPDATE products p SET is_booked = %(new)s
+        FROM locked WHERE p.id = locked.id
+        RETURNING p.id
+    )
+    SELECT req.id,
+           upd.id IS NOT NULL AS changed,
+           EXISTS (SELECT 1 FROM products p WHERE p.id = req.id) AS found
+    FROM req LEFT JOIN upd ON upd.id = req.id
+    ORDER BY req.id
+"""
+
+
+def _parse_bulk_ids(data):
+    """Достаёт список id товаров из тела запроса {"ids": [...]}; при ошибке — ValueError."""
+    ids = (data or {}).get('ids')
+    if not isinstance(ids, list) or not ids:
+        raise ValueError("Необходимо передать непустой список ids")
+    if len(ids) > BULK_BOOKING_MAX_IDS:
+        raise ValueError(f"Не больше {BULK_BOOKING_MAX_IDS} товаров за запрос")
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError("Все ids должны быть целыми числами")
+    return ids
+
+
+def _bulk_set_booked(booked, statuses):
+    """Общая часть bulk-book / bulk-unbook: один запрос, одна транзакция."""
+    try:
+        ids = _parse_bulk_ids(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    action = "бронировании" if booked else "снятии брони"
+    changed_status, unchanged_status = statuses
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            # id вне диапазона int4 не передаём в ::int[] (иначе ошибка на весь запрос) — их просто нет
+            valid_ids = [i for i in ids if 0 < i <= PRODUCT_ID_MAX]
+            cur.execute(BULK_SET_BOOKED_SQL, {'ids': valid_ids, 'old': not booked, 'new': booked})
+            rows = cur.fetchall()
+            rows += [(i, False, False) for i in sorted(set(ids) - set(valid_ids))]
+            rows.sort(key=lambda row: row[0])
+            notify_products(cur, 'update', [product_id for product_id, changed, _ in rows if changed])
+            conn.commit() # Вся пачка фиксируется одной транзакцией
+            position = _remember_write(conn) if any(changed for _, changed, _ in rows) else 0
+
+        results = []
+        changed_count = 0
+        for product_id, changed, found in rows:
+            if changed:
+                status = changed_status
+                changed_count += 1
+            elif found:
+                status = unchanged_status
+            else:
+                status = 'not_found'
+            results.append({"id": product_id, "status": status})
+        if changed_count:
+            bump_catalog_version(position) # Каталог изменился — сбрасываем ETag и кэш
+
+        return jsonify({"results": results, "changed": changed_count}), 200
+
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    except psycopg2.Error as e:
+        print(f"Ошибка при массовом {action}: {e}")
+        return jsonify({"message": f"Ошибка на сервере при массовом {action}"}), 500
+    except Exception as e:
+        print(f"Неожиданная ошибка при массовом {action}: {e}")
+        return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
+
+
+@app.route('/api/products/bulk-book', methods=['POST'])
+def bulk_book_products():
+    """Бронирует пачку товаров: {"ids": [...]} -> статус booked / already_booked / not_found по каждому id."""
+    return _bulk_set_booked(True, ('booked', 'already_booked'))
+
+
+@app.route('/api/products/bulk-unbook', methods=['POST'])
+def bulk_unbook_products():
+    """Снимает бронь с пачки товаров: статус unbooked / not_booked / not_found по каждому id."""
+    return _bulk_set_booked(False, ('unbooked', 'not_booked'))
 
 # --- Новый эндпоинт для получения данных пользователя по ID ---
 @app.route('/api/user/<int:user_id>', methods=['GET'])
 def get_user_data(user_id):
-    conn = None
-    try:
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    # Профили читаются на каждом открытии страницы профиля — сначала смотрим в кэш
+    user_data = profile_cache.get(user_id)
+    if user_data is not None:
+        return jsonify(user_data), 200
 
-        with conn.cursor() as cur:
+    try:
+        with get_db_connection(readonly=True, min_lsn=_client_position()) as conn, conn.cursor() as cur:
             # Выбираем нужные поля из таблицы users по ID
             cur.execute("SELECT username, full_name, phone_number, email FROM users WHERE id = %s", (user_id,))
             user_raw = cur.fetchone()
@@ -372,179 +976,150 @@ def get_user_data(user_id):
             # Преобразуем результат в словарь
             colnames = [desc[0] for desc in cur.description]
             user_data = dict(zip(colnames, user_raw))
-            
-            # Возвращаем данные пользователя (пароль и роль не возвращаем)
-            return jsonify(user_data), 200
 
+        profile_cache.put(user_id, user_data)
+        # Возвращаем данные пользователя (пароль и роль не возвращаем)
+        return jsonify(user_data), 200
+
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
     except psycopg2.Error as e:
         print(f"Ошибка при получении данных пользователя {user_id}: {e}")
         return jsonify({"message": "Ошибка на сервере при получении данных пользователя"}), 500
     except Exception as e:
         print(f"Неожиданная ошибка при получении данных пользователя {user_id}: {e}")
         return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+# --- Пакетное получение профилей (для админки) ---
+USERS_BATCH_MAX_IDS = 500
+
+
+@app.route('/api/users', methods=['GET'])
+@require_role('admin')
+def get_users_batch():
+    """Профили по ?ids=1,2,3: недостающие в кэше дочитываются одним запросом = ANY(%s)."""
+    try:
+        ids = list(dict.fromkeys(int(i) for i in request.args.get('ids', '').split(',') if i.strip()))
+    except ValueError:
+        return jsonify({"message": "Параметр ids должен быть списком целых чисел через запятую"}), 400
+    if not ids:
+        return jsonify({"message": "Необходимо передать ids"}), 400
+    if len(ids) > USERS_BATCH_MAX_IDS:
+        return jsonify({"message": f"Не больше {USERS_BATCH_MAX_IDS} пользователей за запрос"}), 400
+
+    found = {}
+    missing = []
+    for user_id in ids:
+        user_data = profile_cache.get(user_id)
+        if user_data is not None:
+            found[user_id] = user_data
+        else:
+            missing.append(user_id)
+
+    try:
+        if missing:
+            with get_db_connection() as conn, conn.cursor() as cur:
+                cur.execute(
+                    "SELECT id, username, full_name, phone_number, email FROM users WHERE id = ANY(%s)",
+                    (missing,)
+                )
+                for user_id, username, full_name, phone_number, email in cur.fetchall():
+                    user_data = {
+                        "username": username,
+                        "full_name": full_name,
+                        "phone_number": phone_number,
+                        "email": email
+                    }
+                    profile_cache.put(user_id, user_data)
+                    found[user_id] = user_data
+
+        return jsonify({
+            "users": [dict(found[user_id], id=user_id) for user_id in ids if user_id in found],
+            "not_found": [user_id for user_id in ids if user_id not in found]
+        }), 200
+
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    except psycopg2.Error as e:
+        print(f"Ошибка при получении профилей пользователей: {e}")
+        return jsonify({"message": "Ошибка на сервере при получении данных пользователей"}), 500
+    except Exception as e:
+        print(f"Неожиданная ошибка при получении профилей пользователей: {e}")
+        return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
 
 # --- Эндпоинт для удаления товара (только для админов) ---
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
+@require_role('admin')
 def delete_product(product_id):
-    conn = None
+    # Права администратора проверены декоратором require_role по токену, без запроса к БД
     try:
-        # TODO: В реальном приложении здесь нужна проверка прав администратора!
-        # Например, получить токен из заголовка Authorization, проверить пользователя и его роль.
-        
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
-        
-        with conn.cursor() as cur:
+        with get_db_connection() as conn, conn.cursor() as cur:
             # Проверяем, существует ли товар перед удалением (опционально, но хорошо)
             cur.execute("SELECT id FROM products WHERE id = %s", (product_id,))
             product_exists = cur.fetchone()
-            
+
             if not product_exists:
-                conn.close()
                 return jsonify({"message": "Товар не найден"}), 404
 
             # Удаляем товар
             cur.execute("DELETE FROM products WHERE id = %s", (product_id,))
+            notify_products(cur, 'delete', [product_id])
             conn.commit() # Фиксируем удаление
-        
-        conn.close()
+            bump_catalog_version(_remember_write(conn)) # Каталог изменился — сбрасываем ETag и кэш
+
         return jsonify({"message": "Товар успешно удален"}), 200 # или 204 No Content
 
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
     except psycopg2.Error as e:
         print(f"Ошибка базы данных при удалении товара {product_id}: {e}")
-        if conn:
-            conn.rollback()
-            conn.close()
         return jsonify({"message": "Ошибка базы данных при удалении товара"}), 500
     except Exception as e:
         print(f"Неожиданная ошибка при удалении товара {product_id}: {e}")
-        if conn:
-            conn.close()
         return jsonify({"message": "Неожиданная ошибка на сервере"}), 500
 
 # --- Эндпоинт для генерации PDF с забронированными товарами ---
 @app.route('/api/generate-booked-pdf', methods=['GET'])
 def generate_booked_pdf():
-    conn = None
-    # --- Регистрация шрифта DejaVu --- 
-    registered_font_name = 'Helvetica' # Имя шрифта по умолчанию
-    try:
-        # Указываем имя 'DejaVu' и путь к файлу 'DejaVuSans.ttf'
-        pdfmetrics.registerFont(TTFont('DejaVu', 'DejaVuSans.ttf'))
-        registered_font_name = 'DejaVu' # Если успешно, будем использовать это имя
-        print("Successfully registered font DejaVuSans.ttf")
-    except Exception as e:
-        print(f"WARNING: Could not register font DejaVuSans.ttf. Cyrillic text might render incorrectly. Error: {e}")
-        print("Ensure DejaVuSans.ttf is in the same directory as app.py or provide the full path.")
-        # Продолжаем с шрифтом по умолчанию 'Helvetica'
-
+    # Версия до выборки: готовый PDF из кэша берётся, только если каталог с тех пор не менялся
+    version = catalog_version()
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return jsonify({"message": "Ошибка подключения к базе данных"}), 500
-
-        with conn.cursor(cursor_factory=DictCursor) as cur:
+        with get_db_connection(readonly=True, min_lsn=_catalog_position()) as conn, conn.cursor(cursor_factory=DictCursor) as cur:
             # Выбираем только забронированные товары
             cur.execute("SELECT id, name, price FROM products WHERE is_booked = TRUE ORDER BY name")
             booked_items = cur.fetchall()
+        # Соединение возвращено в пул до начала (долгой) генерации PDF
 
         if not booked_items:
             # Если нет забронированных товаров, можно вернуть ошибку или пустой PDF?
             # Вернем ошибку, что нет данных для отчета
              return jsonify({"message": "Нет забронированных товаров для генерации отчета"}), 404
 
-        # --- Генерация PDF --- 
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-        styles = getSampleStyleSheet()
-        title_style = None 
-
-        # Устанавливаем зарегистрированный шрифт для стилей
-        # (Этот try/except блок больше не нужен, так как мы уже обработали ошибку регистрации)
-        styles['Normal'].fontName = registered_font_name
-        print(f"Using font: {registered_font_name} for Normal style")
-
-        # Создаем кастомный стиль для заголовка на основе Normal
-        title_style = ParagraphStyle(
-            name='PdfTitle',
-            parent=styles['Normal'], # Наследует шрифт от Normal
-            fontSize=16,
-            alignment=1,
-            spaceAfter=14
-            # bold=0, italic=0 - уже не нужны, если шрифт обычный
-        )
-
-        # Проверка на случай, если что-то пошло не так с созданием стиля
-        if not title_style:
-             title_style = styles['h1'] 
-             title_style.fontName = registered_font_name
-             title_style.alignment = 1 
-             print("WARNING: Failed to create custom title style, falling back to modified h1.")
-
-        story = []
-
-        # Заголовок (использует title_style с нужным шрифтом)
-        title = "Список забронированных товаров"
-        story.append(Paragraph(title, title_style)) 
-
-        # Данные для таблицы (без ID)
-        data = [['Название', 'Цена (руб.)']] # Убираем 'ID' из заголовков
-        for item in booked_items:
-             price_str = str(item['price']) if item['price'] is not None else 'N/A'
-             data.append([
-                 # Paragraph(str(item['id']), styles['Normal']), # Убираем ID
-                 Paragraph(item['name'], styles['Normal']),
-                 Paragraph(price_str, styles['Normal']) 
-             ])
-
-        # Создание таблицы (корректируем colWidths)
-        table = Table(data, colWidths=[4.5*inch, 1.5*inch]) # Убираем ширину для ID
-
-        # Стили таблицы (корректируем диапазоны, если необходимо)
-        # Так как диапазоны используют относительные индексы (-1), 
-        # большинство стилей должны работать без изменений.
-        # Нужно проверить стиль для первой колонки, если он был специфичен.
-        # Стили ниже должны быть ОК.
-        style = TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('FONTNAME', (0,0), (-1,0), registered_font_name), 
-            ('BOTTOMPADDING', (0,0), (-1,0), 12),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black)
-        ])
-        table.setStyle(style)
-
-        story.append(table)
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Дата генерации отчета (использует styles['Normal'])
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        story.append(Paragraph(f"Отчет сгенерирован: {now}", styles['Normal']))
-
-        # Сборка документа
-        doc.build(story)
-        # --- Конец генерации PDF ---
-
-        buffer.seek(0)
-        
+        now = datetime.now()
         # Генерация имени файла с датой и временем
-        filename = f"booked_items_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        filename = f"booked_items_{now.strftime('%Y%m%d_%H%M%S')}.pdf"
+
+        # Если фоновая задача уже отрисовала этот набор броней при той же версии каталога
+        # (и не раньше REPORT_CACHE_TTL) — отдаём готовый файл
+        cached_path = report_path(booked_set_key(booked_items, version))
+        if cached_path:
+            return send_file(cached_path, mimetype='application/pdf', as_attachment=True, download_name=filename)
+
+        # Шрифт и стили уже подготовлены в reports (один раз на процесс).
+        # PDF пишется в SpooledTemporaryFile: большой отчёт уходит на диск, а не в память
+        # В режиме gevent отрисовка идёт в потоке ОС, чтобы не останавливать остальные запросы воркера
+        pdf_file = run_blocking(render_booked_pdf, booked_items, now)
 
         # Отправка файла пользователю
         return send_file(
-            buffer, 
+            pdf_file, 
             mimetype='application/pdf',
             as_attachment=True, # Скачать как вложение
             download_name=filename # Имя файла для скачивания
         )
 
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
     except psycopg2.Error as e:
         print(f"Ошибка базы данных при генерации PDF: {e}")
         return jsonify({"message": "Ошибка базы данных при генерации отчета"}), 500
@@ -552,9 +1127,66 @@ def generate_booked_pdf():
         # Ловим ошибки генерации PDF или другие
         print(f"Ошибка при генерации PDF: {e}")
         return jsonify({"message": "Не удалось сгенерировать PDF отчет"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+# --- Фоновая генерация PDF отчета ---
+@app.route('/api/reports/booked', methods=['POST'])
+def create_booked_report():
+    """
+    Ставит PDF по забронированным товарам в очередь пула процессов.
+
+    Возвращает job_id (хэш версии каталога и набора броней). Если такой отчёт уже есть в кэше,
+    статус сразу 'done'; иначе 202 и 'pending' — клиент опрашивает
+    GET /api/reports/<job_id> и скачивает /api/reports/<job_id>/download.
+    """
+    version = catalog_version()
+    try:
+        with get_db_connection(readonly=True, min_lsn=_catalog_position()) as conn, conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("SELECT id, name, price FROM products WHERE is_booked = TRUE ORDER BY name")
+            booked_items = cur.fetchall()
+
+        if not booked_items:
+            return jsonify({"message": "Нет забронированных товаров для генерации отчета"}), 404
+
+        job_id, status = submit_booked_report(booked_items, datetime.now(), version)
+        return jsonify({
+            "job_id": job_id,
+            "status": status,
+            "download_url": f"/api/reports/{job_id}/download"
+        }), 200 if status == 'done' else 202
+
+    except DatabaseUnavailable:
+        return jsonify({"message": "Ошибка подключения к базе данных"}), 500
+    except psycopg2.Error as e:
+        print(f"Ошибка базы данных при постановке PDF в очередь: {e}")
+        return jsonify({"message": "Ошибка базы данных при генерации отчета"}), 500
+    except Exception as e:
+        print(f"Ошибка при постановке PDF в очередь: {e}")
+        return jsonify({"message": "Не удалось поставить PDF отчет в очередь"}), 500
+
+
+@app.route('/api/reports/<job_id>', methods=['GET'])
+def get_report_status(job_id):
+    status = job_status(job_id) if is_valid_job_id(job_id) else None
+    if status is None:
+        return jsonify({"message": "Отчет не найден"}), 404
+    return jsonify({"job_id": job_id, "status": status}), 200
+
+
+@app.route('/api/reports/<job_id>/download', methods=['GET'])
+def download_report(job_id):
+    status = job_status(job_id) if is_valid_job_id(job_id) else None
+    if status is None:
+        return jsonify({"message": "Отчет не найден"}), 404
+    if status == 'pending':
+        return jsonify({"message": "Отчет еще формируется"}), 409
+    if status == 'failed':
+        return jsonify({"message": "Не удалось сгенерировать PDF отчет"}), 500
+
+    path = report_path(job_id)
+    if path is None: # Успел вытесниться из кэша
+        return jsonify({"message": "Отчет не найден"}), 404
+    filename = f"booked_items_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    return send_file(path, mimetype='application/pdf', as_attachment=True, download_name=filename)
 
 if __name__ == '__main__':
     # Запуск Flask development server
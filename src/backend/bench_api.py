@@ -0,0 +1,511 @@
+# backend/bench_api.py
+"""
+Нагрузочный бенчмарк API: gunicorn + одноразовый локальный PostgreSQL.
+
+Скрипт поднимает временный кластер PostgreSQL (initdb в tmp-каталоге),
+применяет миграции, заполняет таблицы товарами и пользователями,
+запускает приложение под gunicorn и гоняет сценарии нагрузки:
+
+    catalog  — чтение каталога страницами по курсору
+    booking  — гонка бронирований: много клиентов на небольшом наборе товаров
+    login    — всплеск входов (bcrypt, возможны 503 от пула хэширования)
+    pdf      — скачивание PDF-отчёта по броням
+    mixed    — реалистичная смесь всех операций
+
+Результат — JSON с p50/p95/p99 и пропускной способностью по каждой
+операции. С --baseline результаты сравниваются с сохранённым прогоном,
+и при регрессии скрипт завершается с кодом 1. Пример:
+
+    python bench_api.py --products 100000 --users 1000 --duration 20 \\
+        --json bench_api.json --baseline bench_baseline.json
+
+Сравнение режимов воркеров (см. gunicorn.conf.py): сколько одновременных
+клиентов выдерживает каждый при p99 <= --slo-p99-ms:
+
+    python bench_api.py --scenarios catalog mixed --worker-modes sync gevent \\
+        --concurrency-levels 8 32 128 512
+
+Чтение с реплики (DB_REPLICA_HOSTS, см. db.py): --replica поднимает второй
+временный кластер в потоковой репликации с первым, и приложение читает
+каталог, профили и отчёты с него:
+
+    python bench_api.py --scenarios catalog mixed --replica
+
+Нужны initdb/pg_ctl/pg_basebackup (или --pg-bin) и запуск не от root — PostgreSQL
+от root не стартует. С --external-db используется база из DB_* (она
+будет очищена и заполнена заново).
+"""
+import argparse
+import http.client
+import io
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import bcrypt
+import psycopg2
+
+from migrate import run_migrations
+from passwords import BCRYPT_ROUNDS
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DB_NAME = "lombard_bench"
+BENCH_PASSWORD = "bench-password"
+BENCH_SECRET_KEY = "bench-secret-key-not-for-production"
+
+# Доли операций в сценариях
+SCENARIOS = {
+    "catalog": {"catalog": 1.0},
+    "booking": {"book_race": 1.0},
+    "login": {"login": 1.0},
+    "pdf": {"pdf": 1.0},
+    "mixed": {"catalog": 0.70, "book_race": 0.15, "login": 0.10, "pdf": 0.05},
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pg_tool(pg_bin, name):
+    path = shutil.which(name, path=pg_bin) if pg_bin else shutil.which(name)
+    if path is None and not pg_bin:
+        try:
+            bindir = subprocess.check_output(["pg_config", "--bindir"], text=True).strip()
+            path = shutil.which(name, path=bindir)
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    if path is None:
+        raise RuntimeError(f"Не найден {name}: установите PostgreSQL или укажите --pg-bin")
+    return path
+
+
+class DisposablePostgres:
+    """Временный кластер PostgreSQL; удаляется вместе с каталогом при stop()."""
+
+    def __init__(self, pg_bin=None):
+        self.pg_bin = pg_bin
+        self.port = _free_port()
+        self.data_dir = tempfile.mkdtemp(prefix="lombard_bench_pg_")
+
+    def start(self):
+        print(f"Запуск временного PostgreSQL на порту {self.port}...")
+        subprocess.run(
+            [_pg_tool(self.pg_bin, "initdb"), "-D", self.data_dir, "-U", "postgres",
+             "--auth=trust", "-E", "UTF8", "--no-locale"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        subprocess.run(
+            [_pg_tool(self.pg_bin, "pg_ctl"), "-D", self.data_dir, "-w", "-l",
+             os.path.join(self.data_dir, "server.log"), "-o",
+             f"-p {self.port} -c listen_addresses=127.0.0.1 -k {self.data_dir} -c max_connections=200",
+             "start"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        conn = psycopg2.connect(dbname="postgres", user="postgres", host="127.0.0.1", port=self.port)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE DATABASE {BENCH_DB_NAME}")
+        conn.close()
+        return {"DB_NAME": BENCH_DB_NAME, "DB_USER": "postgres", "DB_PASSWORD": "",
+                "DB_HOST": "127.0.0.1", "DB_PORT": str(self.port)}
+
+    def stop(self):
+        subprocess.run(
+            [_pg_tool(self.pg_bin, "pg_ctl"), "-D", self.data_dir, "-m", "fast", "stop"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+class DisposableReplica:
+    """Реплика временного кластера: pg_basebackup -R и потоковая репликация."""
+
+    def __init__(self, primary):
+        self.primary = primary
+        self.port = _free_port()
+        self.data_dir = tempfile.mkdtemp(prefix="lombard_bench_replica_")
+
+    def start(self):
+        """Запускает реплику; возвращает значение для DB_REPLICA_HOSTS."""
+        print(f"Запуск реплики PostgreSQL на порту {self.port}...")
+        os.rmdir(self.data_dir)  # pg_basebackup создаёт каталог сам
+        subprocess.run(
+            [_pg_tool(self.primary.pg_bin, "pg_basebackup"), "-D", self.data_dir, "-h", "127.0.0.1",
+             "-p", str(self.primary.port), "-U", "postgres", "-R", "-X", "stream"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        subprocess.run(
+            [_pg_tool(self.primary.pg_bin, "pg_ctl"), "-D", self.data_dir, "-w", "-l",
+             os.path.join(self.data_dir, "server.log"), "-o",
+             f"-p {self.port} -c listen_addresses=127.0.0.1 -k {self.data_dir} -c max_connections=200",
+             "start"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        return f"127.0.0.1:{self.port}"
+
+    def stop(self):
+        subprocess.run(
+            [_pg_tool(self.primary.pg_bin, "pg_ctl"), "-D", self.data_dir, "-m", "fast", "stop"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+def _connect(db_env):
+    return psycopg2.connect(
+        dbname=db_env["DB_NAME"], user=db_env["DB_USER"], password=db_env["DB_PASSWORD"] or None,
+        host=db_env["DB_HOST"], port=db_env["DB_PORT"]
+    )
+
+
+def seed(db_env, products, users, booked_share):
+    """Схема через миграции и данные через COPY; у всех пользователей один пароль."""
+    print(f"Заполнение БД: {products} товаров, {users} пользователей...")
+    conn = _connect(db_env)
+    try:
+        run_migrations(conn)
+        # Один хэш на всех: вход всё равно платит полную стоимость bcrypt при проверке
+        password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
+        rng = random.Random(42)
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE products, users RESTART IDENTITY")
+            rows = io.StringIO()
+            for i in range(products):
+                booked = "t" if rng.random() < booked_share else "f"
+                rows.write(f"Товар {i} проба {rng.choice((375, 585, 750))}\t{rng.randint(100, 500000) / 100}\t{booked}\n")
+            rows.seek(0)
+            cur.copy_expert("COPY products (name, price, is_booked) FROM STDIN", rows)
+            rows = io.StringIO()
+            for i in range(users):
+                role = "admin" if i == 0 else "user"
+                rows.write(f"bench{i}\t{password_hash}\t{role}\tПользователь {i}\tbench{i}@example.com\n")
+            rows.seek(0)
+            cur.copy_expert("COPY users (username, password_hash, role, full_name, email) FROM STDIN", rows)
+            cur.execute("ANALYZE products")
+            cur.execute("ANALYZE users")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class GunicornServer:
+    """Приложение под gunicorn с переданными переменными окружения."""
+
+    def __init__(self, db_env, workers, extra_args, worker_mode="sync"):
+        self.port = _free_port()
+        self.db_env = dict(db_env, WORKER_MODE=worker_mode)
+        self.workers = workers
+        self.extra_args = extra_args
+        self.process = None
+
+    def start(self):
+        env = dict(os.environ, **self.db_env)
+        # Общий ключ: токен, выданный одним воркером, принимается всеми
+        env.setdefault("AUTH_SECRET_KEY", BENCH_SECRET_KEY)
+        command = [sys.executable, "-m", "gunicorn", "app:app", "-b", f"127.0.0.1:{self.port}",
+                   "-w", str(self.workers)] + self.extra_args
+        print(f"Запуск: {' '.join(command)}")
+        self.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("gunicorn завершился при старте")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=2)
+                conn.request("GET", "/")
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("gunicorn не ответил за 30 секунд")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class Client:
+    """Один виртуальный пользователь со своим HTTP-соединением."""
+
+    def __init__(self, port, products, users, hot_products, rng):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        self.products = products
+        self.users = users
+        self.hot_products = hot_products
+        self.rng = rng
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            return 0
+
+    def catalog(self):
+        cursor = self.rng.randint(0, max(self.products - 50, 0))
+        return [("catalog", *self._timed("GET", "/api/products?" + urlencode({"limit": 50, "cursor": cursor})))]
+
+    def book_race(self):
+        product_id = self.rng.randint(1, self.hot_products)
+        results = [("book", *self._timed("PUT", f"/api/products/{product_id}/book"))]
+        if results[0][2] == 200:
+            results.append(("unbook", *self._timed("PUT", f"/api/products/{product_id}/unbook")))
+        return results
+
+    def login(self):
+        body = {"username": f"bench{self.rng.randrange(self.users)}", "password": BENCH_PASSWORD}
+        return [("login", *self._timed("POST", "/api/login", body))]
+
+    def pdf(self):
+        return [("pdf", *self._timed("GET", "/api/generate-booked-pdf"))]
+
+    def _timed(self, method, path, body=None):
+        started = time.perf_counter()
+        status = self.request(method, path, body)
+        return time.perf_counter() - started, status
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    # Nearest-rank: наименьшее значение, не меньше которого q доли выборки
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _summarize(samples, duration):
+    """samples: [(секунды, статус)] -> сводка в миллисекундах."""
+    latencies = sorted(seconds for seconds, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+    return {
+        "count": len(samples),
+        "rps": round(len(samples) / duration, 1),
+        "p50_ms": ms(_percentile(latencies, 0.50)),
+        "p95_ms": ms(_percentile(latencies, 0.95)),
+        "p99_ms": ms(_percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+        "statuses": statuses,
+    }
+
+
+def run_scenario(name, port, args, concurrency=None):
+    """Гоняет сценарий concurrency клиентами; сначала прогрев, потом замер."""
+    mix = SCENARIOS[name]
+    ops, weights = zip(*mix.items())
+    samples = {}
+    samples_lock = threading.Lock()
+    stop_at = [0.0]
+    recording = threading.Event()
+
+    def worker(index):
+        rng = random.Random(index)
+        client = Client(port, args.products, args.users, args.hot_products, rng)
+        local = {}
+        while time.monotonic() < stop_at[0]:
+            op = rng.choices(ops, weights)[0]
+            results = getattr(client, op)()
+            if recording.is_set():
+                for op_name, seconds, status in results:
+                    local.setdefault(op_name, []).append((seconds, status))
+        with samples_lock:
+            for op_name, values in local.items():
+                samples.setdefault(op_name, []).extend(values)
+
+    if concurrency is None:
+        concurrency = args.login_concurrency if name == "login" else args.concurrency
+    print(f"Сценарий {name}: {concurrency} клиентов, прогрев {args.warmup} с, замер {args.duration} с")
+    stop_at[0] = time.monotonic() + args.warmup + args.duration
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    recording.set()
+    started = time.monotonic()
+    for thread in threads:
+        thread.join()
+    duration = time.monotonic() - started
+
+    result = {"concurrency": concurrency, "ops": {}}
+    all_samples = []
+    for op_name, values in sorted(samples.items()):
+        result["ops"][op_name] = _summarize(values, duration)
+        all_samples.extend(values)
+    result["total"] = _summarize(all_samples, duration)
+    return result
+
+
+def compare(current, baseline, tolerance):
+    """Список регрессий: p95 выросла или rps упала больше чем на tolerance."""
+    regressions = []
+    for scenario, result in current["scenarios"].items():
+        base_ops = baseline.get("scenarios", {}).get(scenario, {}).get("ops", {})
+        for op_name, stats in result["ops"].items():
+            base = base_ops.get(op_name)
+            if not base or not base.get("p95_ms") or not stats.get("p95_ms"):
+                continue
+            # Разница меньше миллисекунды — шум, а не регрессия
+            if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance) and stats["p95_ms"] - base["p95_ms"] > 1:
+                regressions.append(f"{scenario}/{op_name}: p95 {base['p95_ms']} -> {stats['p95_ms']} мс")
+            if base.get("rps") and stats["rps"] < base["rps"] * (1 - tolerance):
+                regressions.append(f"{scenario}/{op_name}: rps {base['rps']} -> {stats['rps']}")
+    return regressions
+
+
+def sustained_clients(results, slo_p99_ms, max_error_share):
+    """
+    Для каждого режима и сценария — наибольшее число клиентов, при котором
+    p99 укладывается в SLO, а доля ошибок (5xx и обрывы) не больше допустимой.
+    """
+    sustained = {}
+    for key, result in results["scenarios"].items():
+        mode, _, rest = key.partition(":")
+        scenario, _, level = rest.partition("@")
+        total = result["total"]
+        errors = sum(count for status, count in total["statuses"].items() if status == "0" or status.startswith("5"))
+        ok = (total["count"] and total["p99_ms"] is not None and total["p99_ms"] <= slo_p99_ms
+              and errors / total["count"] <= max_error_share)
+        best = sustained.setdefault(mode, {}).setdefault(scenario, 0)
+        if ok and int(level) > best:
+            sustained[mode][scenario] = int(level)
+    return sustained
+
+
+def _print_table(results):
+    print(f"{'scenario':>22} {'op':>8} {'count':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}  statuses")
+    for scenario, result in results["scenarios"].items():
+        for op_name, stats in result["ops"].items():
+            print(f"{scenario:>22} {op_name:>8} {stats['count']:>7} {stats['rps']:>8} {stats['p50_ms']!s:>8} "
+                  f"{stats['p95_ms']!s:>8} {stats['p99_ms']!s:>8}  {stats['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк API ломбарда")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=["catalog", "booking", "login", "pdf", "mixed"])
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--booked-share", type=float, default=0.02, help="Доля товаров, забронированных заранее (для PDF)")
+    parser.add_argument("--hot-products", type=int, default=20, help="Сколько товаров делят клиенты в гонке бронирований")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--login-concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15, help="Секунд замера на сценарий")
+    parser.add_argument("--warmup", type=float, default=3, help="Секунд прогрева на сценарий (не учитываются)")
+    parser.add_argument("--workers", type=int, default=2, help="Воркеров gunicorn")
+    parser.add_argument("--gunicorn-args", default="", help="Дополнительные аргументы gunicorn одной строкой")
+    parser.add_argument("--worker-modes", nargs="+", choices=["sync", "gthread", "gevent"], default=["sync"],
+                        help="Режимы воркеров (WORKER_MODE) для сравнения")
+    parser.add_argument("--concurrency-levels", type=int, nargs="+",
+                        help="Прогнать сценарии при каждом числе клиентов и найти предел для каждого режима")
+    parser.add_argument("--slo-p99-ms", type=float, default=500, help="p99, при котором уровень нагрузки ещё считается выдержанным")
+    parser.add_argument("--max-error-share", type=float, default=0.01, help="Допустимая доля 5xx и обрывов соединения")
+    parser.add_argument("--pg-bin", help="Каталог с initdb/pg_ctl")
+    parser.add_argument("--external-db", action="store_true", help="Использовать базу из DB_* вместо временной (данные будут удалены!)")
+    parser.add_argument("--replica", action="store_true", help="Поднять реплику временного кластера и читать с неё (DB_REPLICA_HOSTS)")
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимое ухудшение относительно baseline")
+    args = parser.parse_args()
+    if args.replica and args.external_db:
+        parser.error("--replica работает только с временным кластером; для своей базы задайте DB_REPLICA_HOSTS")
+
+    postgres = None
+    replica = None
+    server = None
+    try:
+        if args.external_db:
+            from db import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+            db_env = {"DB_NAME": DB_NAME, "DB_USER": DB_USER, "DB_PASSWORD": DB_PASSWORD or "",
+                      "DB_HOST": DB_HOST, "DB_PORT": DB_PORT}
+        else:
+            postgres = DisposablePostgres(args.pg_bin)
+            db_env = postgres.start()
+        seed(db_env, args.products, args.users, args.booked_share)
+        if args.replica:
+            # Копия снимается после заполнения: дальше реплика догоняет основной сервер по WAL
+            replica = DisposableReplica(postgres)
+            db_env = dict(db_env, DB_REPLICA_HOSTS=replica.start())
+
+        results = {
+            "meta": {
+                "products": args.products, "users": args.users, "workers": args.workers,
+                "gunicorn_args": args.gunicorn_args, "worker_modes": args.worker_modes,
+                "duration": args.duration, "bcrypt_rounds": BCRYPT_ROUNDS, "replica": args.replica,
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "scenarios": {},
+        }
+        # Обычный прогон одного режима — ключи по именам сценариев, как в сохранённых baseline
+        sweep = args.concurrency_levels or len(args.worker_modes) > 1
+        for mode in args.worker_modes:
+            server = GunicornServer(db_env, args.workers, args.gunicorn_args.split(), mode)
+            server.start()
+            print(f"Режим воркеров: {mode}")
+            for name in args.scenarios:
+                if not sweep:
+                    results["scenarios"][name] = run_scenario(name, server.port, args)
+                    continue
+                for level in args.concurrency_levels or [args.concurrency]:
+                    results["scenarios"][f"{mode}:{name}@{level}"] = run_scenario(name, server.port, args, level)
+            server.stop()
+            server = None
+        if sweep:
+            results["sustained_clients"] = sustained_clients(results, args.slo_p99_ms, args.max_error_share)
+    finally:
+        if server is not None:
+            server.stop()
+        if replica is not None:
+            replica.stop()
+        if postgres is not None:
+            postgres.stop()
+
+    _print_table(results)
+    for mode, scenarios in results.get("sustained_clients", {}).items():
+        per_worker = ", ".join(f"{name}: {level} ({level / args.workers:g} на воркер)" for name, level in scenarios.items())
+        print(f"Выдерживает клиентов в режиме {mode}: {per_worker}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("РЕГРЕССИИ относительно baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("Регрессий относительно baseline нет.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# backend/bench_json.py
+"""
+Замер сериализации страницы каталога: время и выделенная память.
+
+Сравниваются способы получить тело ответа из строк (id, name, price,
+is_booked, image_url), как их отдаёт psycopg2:
+
+    dict_json    — как было: dict(zip(...)) и Decimal -> float по строке, затем json
+    dict_orjson  — те же словари, но orjson
+    bulk_orjson  — словари одним списковым выражением, Decimal через default= orjson
+    pg_text      — тело уже собрано в PostgreSQL (json_agg): только encode строки
+
+Для pg_text строка JSON готовится заранее — это то, что приходит из БД;
+время самого json_agg видно в bench_api.py (сценарий catalog). Пример:
+
+    python bench_json.py --rows 50 200 1000 10000 --json bench_json.json
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FIELDS = ('id', 'name', 'price', 'is_booked', 'image_url')
+
+
+def _make_rows(count):
+    return [
+        (i, f"Товар №{i} золотое кольцо, проба 585", Decimal(1000 + i % 5000) / 100, i % 7 == 0,
+         f"https://example.com/img/{i}.jpg" if i % 3 else None)
+        for i in range(1, count + 1)
+    ]
+
+
+def _decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+def dict_json(rows):
+    items = []
+    for row in rows:
+        item = dict(zip(FIELDS, row))
+        if item.get('price') is not None:
+            item['price'] = float(item['price'])
+        items.append(item)
+    return json.dumps({"items": items, "next_cursor": items[-1]['id']}).encode('utf-8')
+
+
+def dict_orjson(rows):
+    items = []
+    for row in rows:
+        item = dict(zip(FIELDS, row))
+        if item.get('price') is not None:
+            item['price'] = float(item['price'])
+        items.append(item)
+    return orjson.dumps({"items": items, "next_cursor": items[-1]['id']})
+
+
+def bulk_orjson(rows):
+    items = [dict(zip(FIELDS, row)) for row in rows]
+    return orjson.dumps({"items": items, "next_cursor": rows[-1][0]}, default=_decimal_default)
+
+
+def _pg_body(rows):
+    """Строка, которую вернул бы json_agg (Decimal как есть — numeric в JSON)."""
+    items = [
+        '{"id" : %d, "name" : %s, "price" : %s, "is_booked" : %s, "image_url" : %s}' % (
+            r[0], json.dumps(r[1], ensure_ascii=False), r[2], 'true' if r[3] else 'false', json.dumps(r[4]))
+        for r in rows
+    ]
+    return '{"items" : [' + ', '.join(items) + '], "next_cursor" : %d}' % rows[-1][0]
+
+
+def _measure(fn, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сериализации каталога в JSON")
+    parser.add_argument('--rows', type=int, nargs='+', default=[50, 200, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20, help="Лучшее время из стольких повторов")
+    parser.add_argument('--json', help="Сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    methods = [('dict_json', dict_json, False)]
+    if orjson is not None:
+        methods += [('dict_orjson', dict_orjson, False), ('bulk_orjson', bulk_orjson, False)]
+    else:
+        print("orjson не установлен: варианты dict_orjson и bulk_orjson пропущены")
+    methods.append(('pg_text', lambda body: body.encode('utf-8'), True))
+
+    results = []
+    print(f"{'rows':>7} {'method':>12} {'ms':>9} {'peak KB':>9} {'body KB':>8}")
+    for count in args.rows:
+        rows = _make_rows(count)
+        pg_body = _pg_body(rows)
+        for name, fn, takes_text in methods:
+            arg = pg_body if takes_text else rows
+            seconds, peak = _measure(fn, arg, args.repeat)
+            result = {
+                'rows': count,
+                'method': name,
+                'ms': round(seconds * 1000, 3),
+                'peak_alloc_kb': round(peak / 1024, 1),
+                'body_kb': round(len(fn(arg)) / 1024, 1),
+            }
+            results.append(result)
+            print(f"{count:>7} {name:>12} {result['ms']:>9} {result['peak_alloc_kb']:>9} {result['body_kb']:>8}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
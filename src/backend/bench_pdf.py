@@ -0,0 +1,85 @@
+# backend/bench_pdf.py
+"""
+Замер генерации PDF-отчёта по забронированным товарам.
+
+Для каждого размера списка отчёт рендерится в отдельном процессе, чтобы
+пиковая память (ru_maxrss) не смешивалась между замерами. Пример:
+
+    python bench_pdf.py --sizes 10 100 1000 10000 100000 --json bench_pdf.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from decimal import Decimal
+
+
+def _make_items(count):
+    items = []
+    for i in range(count):
+        # Каждое десятое название длинное, чтобы проверить перенос строк
+        name = f"Товар №{i} " + ("золотое кольцо с бриллиантом, проба 585, " * 3 if i % 10 == 0 else "часы")
+        items.append({'id': i, 'name': name, 'price': Decimal(1000 + i % 5000) / 100})
+    return items
+
+
+def _peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def _run_one(count, chunked, queue):
+    import reports
+    reports.warm_up()
+    items = _make_items(count)
+    rss_before = _peak_rss_mb()
+    started = time.perf_counter()
+    output = reports.render_booked_pdf(items, chunked=chunked)
+    elapsed = time.perf_counter() - started
+    output.seek(0, os.SEEK_END)
+    size = output.tell()
+    queue.put({
+        'rows': count,
+        'mode': 'chunked' if chunked else 'classic',
+        'seconds': round(elapsed, 3),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'rss_growth_mb': round(_peak_rss_mb() - rss_before, 1),
+        'pdf_kb': round(size / 1024, 1),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк генерации PDF-отчёта")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--modes', nargs='+', choices=['chunked', 'classic'], default=['chunked', 'classic'])
+    parser.add_argument('--classic-max', type=int, default=10000,
+                        help="Классический режим на больших списках работает очень долго; выше этого размера он пропускается")
+    parser.add_argument('--json', help="Сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rows':>8} {'mode':>8} {'sec':>9} {'peak MB':>9} {'growth MB':>10} {'pdf KB':>9}")
+    for count in args.sizes:
+        for mode in args.modes:
+            if mode == 'classic' and count > args.classic_max:
+                continue
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_run_one, args=(count, mode == 'chunked', queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+            print(f"{result['rows']:>8} {result['mode']:>8} {result['seconds']:>9} "
+                  f"{result['peak_rss_mb']:>9} {result['rss_growth_mb']:>10} {result['pdf_kb']:>9}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# backend/bench_search.py
+"""
+Замер поиска товаров (/api/products/search) прямо на уровне SQL.
+
+Поднимает временный PostgreSQL (как bench_api.py), применяет миграции,
+заполняет каталог правдоподобными названиями и выполняет запрос поиска
+для набора типичных запросов: слово, словоформа, опечатка, подстрока,
+несколько слов. Печатает p50/p95/p99 по каждому виду и план одного
+запроса, чтобы было видно, какие индексы используются. Пример:
+
+    python bench_search.py --products 100000 --queries 200 --json bench_search.json
+
+Цель — меньше 10 мс на запрос при 100 тыс. товаров.
+"""
+import argparse
+import io
+import json
+import random
+import time
+
+from bench_api import DisposablePostgres, _connect, _percentile
+from migrate import run_migrations
+from product_search import SEARCH_SQL, search_params
+
+ITEMS = ["кольцо", "серьги", "цепочка", "браслет", "часы", "кулон", "брошь", "запонки", "подвеска", "печатка"]
+MATERIALS = ["золотое", "серебряное", "платиновое", "позолоченное"]
+DETAILS = ["с бриллиантом", "с сапфиром", "с изумрудом", "с фианитом", "гравировка", "винтаж", "б/у", "новое"]
+BRANDS = ["Sokolov", "Адамас", "Sunlight", "Эстет", "Casio", "Orient", "Seiko", "Tissot"]
+
+# Вид запроса -> примеры; для каждого прогона берётся случайный
+QUERY_KINDS = {
+    "word": ["кольцо", "браслет", "часы", "цепочка"],
+    "word_form": ["кольца", "серьгами", "цепочки", "браслеты"],
+    "typo": ["кольйо", "браслтеы", "цепочко", "сапфирм"],
+    "substring": ["кольц", "брасл", "seik", "адам"],
+    "phrase": ["золотое кольцо", "серьги с бриллиантом", "часы Casio", "серебряная цепочка"],
+}
+
+
+def _product_name(rng):
+    parts = [rng.choice(MATERIALS), rng.choice(ITEMS)]
+    if rng.random() < 0.6:
+        parts.append(rng.choice(DETAILS))
+    if rng.random() < 0.4:
+        parts.append(rng.choice(BRANDS))
+    parts.append(f"проба {rng.choice((375, 585, 750, 925))}")
+    return " ".join(parts)
+
+
+def seed_products(conn, count):
+    rng = random.Random(7)
+    rows = io.StringIO()
+    for _ in range(count):
+        rows.write(f"{_product_name(rng)}\t{rng.randint(100, 500000) / 100}\n")
+    rows.seek(0)
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE products RESTART IDENTITY")
+        cur.copy_expert("COPY products (name, price) FROM STDIN", rows)
+        cur.execute("ANALYZE products")
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска товаров по названию")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200, help="Запросов каждого вида")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--pg-bin", help="Каталог с initdb/pg_ctl")
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    postgres = DisposablePostgres(args.pg_bin)
+    results = {"products": args.products, "kinds": {}}
+    try:
+        # Внутри try: если запуск упадёт после initdb, stop() всё равно удалит каталог кластера
+        db_env = postgres.start()
+        conn = _connect(db_env)
+        run_migrations(conn)
+        print(f"Заполнение каталога: {args.products} товаров...")
+        seed_products(conn, args.products)
+
+        rng = random.Random(1)
+        with conn.cursor() as cur:
+            for kind, samples in QUERY_KINDS.items():
+                # Прогрев: кэш страниц индексов и планов
+                for q in samples:
+                    cur.execute(SEARCH_SQL, search_params(q, args.limit))
+                    cur.fetchone()
+                timings = []
+                for _ in range(args.queries):
+                    q = rng.choice(samples)
+                    started = time.perf_counter()
+                    cur.execute(SEARCH_SQL, search_params(q, args.limit))
+                    body = cur.fetchone()[0]
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+                results["kinds"][kind] = {
+                    "p50_ms": round(_percentile(timings, 0.50) * 1000, 2),
+                    "p95_ms": round(_percentile(timings, 0.95) * 1000, 2),
+                    "p99_ms": round(_percentile(timings, 0.99) * 1000, 2),
+                    "sample_hits": len(json.loads(body)["items"]),
+                }
+            cur.execute("EXPLAIN (ANALYZE, COSTS OFF) " + SEARCH_SQL, search_params("золотое кольцо", args.limit))
+            plan = "\n".join(row[0] for row in cur.fetchall())
+        conn.rollback()
+        conn.close()
+    finally:
+        postgres.stop()
+
+    print(f"{'kind':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'hits':>5}")
+    for kind, stats in results["kinds"].items():
+        print(f"{kind:>10} {stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['sample_hits']:>5}")
+    print("План запроса «золотое кольцо»:")
+    print(plan)
+    results["plan"] = plan
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# backend/catalog_cache.py
+"""
+Версия каталога и кэш сериализованных ответов GET /api/products.
+
+Версия хранится в маленьком файле, отображённом в память (mmap), поэтому
+её видят все воркеры gunicorn на одной машине: запись в одном воркере
+сразу инвалидирует ETag и кэш в остальных. Обработчики, меняющие товары,
+вызывают bump_catalog_version() после успешного commit.
+
+Рядом с версией хранится позиция WAL последней записи в каталог (если
+включены реплики, см. db.py): чтение каталога с реплики, не догнавшей
+эту позицию, могло бы закэшировать старые данные под новой версией.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+from process_local import ProcessLocal
+
+try:
+    import fcntl  # Межпроцессная блокировка (нет на Windows — там dev-сервер в одном процессе)
+except ImportError:
+    fcntl = None
+
+CATALOG_VERSION_FILE = os.getenv(
+    "CATALOG_VERSION_FILE",
+    os.path.join(tempfile.gettempdir(), "lombard_catalog_version")
+)
+CATALOG_CACHE_MAX_BYTES = int(os.getenv("CATALOG_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Формат файла: эпоха (случайное число при создании файла) + счётчик изменений + позиция WAL
+_VERSION_FORMAT = "<QQQ"
+_VERSION_SIZE = struct.calcsize(_VERSION_FORMAT)
+
+_version_lock = threading.Lock()
+
+
+def _open_version_file():
+    """Открывает (и при необходимости создаёт) файл версии каталога: (fd, mmap)."""
+    fd = os.open(CATALOG_VERSION_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+    _lock(fd, exclusive=True)
+    try:
+        if os.fstat(fd).st_size < _VERSION_SIZE:
+            epoch = int.from_bytes(os.urandom(8), "little")
+            os.ftruncate(fd, _VERSION_SIZE)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, struct.pack(_VERSION_FORMAT, epoch, 0, 0))
+    finally:
+        _unlock(fd)
+    return fd, mmap.mmap(fd, _VERSION_SIZE)
+
+
+# flock привязан к открытому файлу, поэтому после fork файл открывается заново
+_version_file = ProcessLocal(_open_version_file)
+
+
+def _lock(fd, exclusive):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _read_version():
+    fd, vmap = _version_file.get()
+    _lock(fd, exclusive=False)
+    try:
+        return struct.unpack(_VERSION_FORMAT, vmap[:_VERSION_SIZE])
+    finally:
+        _unlock(fd)
+
+
+def catalog_version():
+    """Текущая версия каталога в виде строки 'эпоха-счётчик'."""
+    epoch, counter, _ = _read_version()
+    return f"{epoch:x}-{counter}"
+
+
+def catalog_write_lsn():
+    """
+    Позиция WAL последней записи в каталог (0 — неизвестна или реплик нет).
+
+    Читать после catalog_version(): позиция только растёт, поэтому она
+    покрывает все изменения, вошедшие в прочитанную версию.
+    """
+    return _read_version()[2]
+
+
+def bump_catalog_version(write_lsn=0):
+    """
+    Увеличивает версию каталога; вызывать после commit изменения товаров.
+
+    write_lsn — позиция WAL основного сервера после commit (db.write_position).
+    """
+    fd, vmap = _version_file.get()
+    with _version_lock:
+        _lock(fd, exclusive=True)
+        try:
+            epoch, counter, lsn = struct.unpack(_VERSION_FORMAT, vmap[:_VERSION_SIZE])
+            vmap[:_VERSION_SIZE] = struct.pack(_VERSION_FORMAT, epoch, counter + 1, max(lsn, write_lsn))
+        finally:
+            _unlock(fd)
+
+
+def make_etag(version, key):
+    """Сильный ETag для представления: версия каталога + параметры запроса."""
+    digest = hashlib.sha1(f"{version}|{key}".encode("utf-8")).hexdigest()[:20]
+    return f"{version}-{digest}"
+
+
+def query_key(args):
+    """Нормализованный ключ кэша из query-параметров (порядок не важен)."""
+    return "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+
+
+class ResponseCache:
+    """
+    LRU-кэш готовых тел ответов, ограниченный суммарным размером в байтах.
+
+    Все записи относятся к одной версии каталога: при смене версии кэш
+    очищается целиком.
+    """
+
+    def __init__(self, max_bytes=CATALOG_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._size = 0
+            self._version = version
+
+    def get(self, version, key):
+        """Возвращает закэшированное тело или None."""
+        with self._lock:
+            self._check_version(version)
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, version, key, body):
+        """Сохраняет тело ответа; слишком большие ответы не кэшируются."""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
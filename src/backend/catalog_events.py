@@ -0,0 +1,194 @@
+# backend/catalog_events.py
+"""
+Живые обновления каталога: PostgreSQL NOTIFY -> Server-Sent Events.
+
+Изменяющие обработчики в той же транзакции вызывают notify_products():
+PostgreSQL доставит уведомление только после COMMIT, поэтому подписчики
+никогда не видят откатанных изменений. Payload — JSON:
+    {"action": "update" | "insert", "product": {...строка товара...}}
+    {"action": "delete", "product": {"id": ...}}
+    {"action": "reload"} — изменений слишком много (импорт) или события
+                           могли потеряться: клиенту нужно перечитать каталог.
+
+В каждом воркере одно отдельное соединение делает LISTEN и раздаёт события
+всем подписчикам этого воркера, сколько бы вкладок ни было открыто.
+Долгий SSE-ответ занимает обработчик запроса на всё время подписки:
+в режиме sync это весь процесс воркера, поэтому там подписка отклоняется
+(см. subscriber_limit) и клиент переходит на периодическое перечитывание.
+В режиме gevent подписчиков на воркер не больше SSE_MAX_SUBSCRIBERS, в
+gthread — не больше половины потоков, чтобы остальные запросы обслуживались.
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+from db import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+from green import concurrent_requests
+from process_local import ProcessLocal
+from thumbnails import THUMBNAIL_URL_SQL
+
+CATALOG_CHANNEL = "catalog_changes"
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "100"))  # На воркер
+SSE_QUEUE_SIZE = 256  # Событий в очереди подписчика; медленный получает reload
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))  # сек. между комментариями-пингами
+LISTEN_RECONNECT_DELAY = 2  # сек. до повторного подключения слушателя
+NOTIFY_MAX_BYTES = 7000  # Ограничение payload NOTIFY — 8000 байт; длиннее отправляется только id
+
+# Уведомление на каждую затронутую строку одним запросом
+_NOTIFY_ROWS_SQL = """
+    SELECT pg_notify(%s, json_build_object(
+        'action', %s,
+        'product', CASE WHEN octet_length(row_to_json(p)::text) < %s
+                        THEN row_to_json(p) ELSE json_build_object('id', p.id) END
+    )::text)
+    FROM (SELECT id, name, price, is_booked, image_url, """ + THUMBNAIL_URL_SQL + """ AS thumbnail_url
+          FROM products WHERE id = ANY(%s)) p
+"""
+
+RELOAD_EVENT = {"action": "reload"}
+
+
+class TooManySubscribers(Exception):
+    """Лимит SSE-подписчиков воркера исчерпан."""
+
+
+def subscriber_limit():
+    """Сколько SSE-подписчиков может держать воркер в текущем режиме (0 — ни одного)."""
+    slots = concurrent_requests()
+    if slots is None:
+        return SSE_MAX_SUBSCRIBERS
+    return min(SSE_MAX_SUBSCRIBERS, slots // 2)
+
+
+def notify_products(cur, action, product_ids):
+    """Ставит уведомления по товарам в текущую транзакцию (уйдут после COMMIT)."""
+    if not product_ids:
+        return
+    if action == "delete":
+        for product_id in product_ids:
+            payload = json.dumps({"action": "delete", "product": {"id": product_id}})
+            cur.execute("SELECT pg_notify(%s, %s)", (CATALOG_CHANNEL, payload))
+        return
+    cur.execute(_NOTIFY_ROWS_SQL, (CATALOG_CHANNEL, action, NOTIFY_MAX_BYTES, list(product_ids)))
+
+
+def notify_reload(cur):
+    """Одно событие «перечитайте каталог» вместо тысяч строк (массовый импорт)."""
+    cur.execute("SELECT pg_notify(%s, %s)", (CATALOG_CHANNEL, json.dumps(RELOAD_EVENT)))
+
+
+class _Hub:
+    """LISTEN-соединение воркера и очереди его подписчиков."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self):
+        with self.lock:
+            if len(self.subscribers) >= subscriber_limit():
+                raise TooManySubscribers("Слишком много подписчиков на обновления каталога")
+            subscriber = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._listen_forever, name="catalog-listen", daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Клиент не успевает читать: очищаем его очередь и просим перечитать каталог
+                _drain(subscriber)
+                subscriber.put_nowait(RELOAD_EVENT)
+
+    def _listen_forever(self):
+        first = True
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CATALOG_CHANNEL}")
+                if not first:
+                    # Пока слушателя не было, события могли пройти мимо
+                    self.publish(RELOAD_EVENT)
+                first = False
+                while True:
+                    if select.select([conn], [], [], SSE_HEARTBEAT) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            self.publish(json.loads(notify.payload))
+                        except ValueError:
+                            print(f"Некорректное уведомление каталога: {notify.payload[:200]}")
+            except Exception as e:
+                print(f"Ошибка слушателя обновлений каталога: {e}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+            time.sleep(LISTEN_RECONNECT_DELAY)
+
+
+def _drain(subscriber):
+    try:
+        while True:
+            subscriber.get_nowait()
+    except queue.Empty:
+        pass
+
+
+# Хаб текущего процесса (после fork создаётся заново вместе со слушателем)
+_hub = ProcessLocal(_Hub)
+
+
+def subscribe():
+    """Новая очередь событий каталога; бросает TooManySubscribers при превышении лимита."""
+    return _hub.get().subscribe()
+
+
+def unsubscribe(subscriber):
+    _hub.get().unsubscribe(subscriber)
+
+
+def iter_sse(subscriber):
+    """
+    Поток Server-Sent Events для подписчика.
+
+    Событие — «event: <action>» и «data: <json>». Каждые SSE_HEARTBEAT секунд
+    без событий уходит комментарий, чтобы прокси не закрывали соединение.
+    Подписка снимается, когда клиент отключается (генератор закрывается).
+    """
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = subscriber.get(timeout=SSE_HEARTBEAT)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+            yield f"event: {event.get('action', 'message')}\ndata: {data}\n\n"
+    finally:
+        unsubscribe(subscriber)
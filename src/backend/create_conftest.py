@@ -33,6 +33,8 @@ def mock_db(mocker):
     mock_dict_cursor = mocker.MagicMock()
     mocker.patch('psycopg2.extras.DictCursor', return_value=mock_dict_cursor)
 
+    # get_db_connection — контекстный менеджер: with get_db_connection() as conn
+    mock_conn.__enter__.return_value = mock_conn
     # Мокаем саму функцию подключения
     mocker.patch('app.get_db_connection', return_value=mock_conn)
     # Возвращаем моки, чтобы их можно было использовать в тестах
@@ -0,0 +1,303 @@
+# backend/db.py
+"""
+Пул соединений с PostgreSQL.
+
+Один пул на процесс воркера gunicorn: после fork пул создаётся заново,
+соединения родителя не используются и не закрываются в дочернем процессе.
+Все обработчики берут соединение только через контекстный менеджер
+get_db_connection(), который сам возвращает его в пул.
+
+Если заданы DB_REPLICA_HOSTS, у процесса есть ещё пулы к репликам
+(потоковая репликация). get_db_connection(readonly=True) отдаёт
+соединение с реплики, которая уже воспроизвела WAL до позиции min_lsn;
+отстающая, недоступная или занятая (все соединения её пула выданы)
+реплика — чтение сразу идёт на основной сервер.
+Позицию своей записи обработчик берёт через write_position() сразу
+после commit и передаёт читателям (клиенту в заголовке, каталогу —
+через файл версии), чтобы они увидели эту запись.
+"""
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+from dotenv import load_dotenv
+
+from metrics import DB_CONNECTIONS_IN_USE, DB_POOL_WAIT, DB_READ_ROUTES, add_phase_time, connection_factory
+from process_local import ProcessLocal
+
+load_dotenv()
+
+# --- Настройки подключения к БД ---
+DB_NAME = os.getenv("DB_NAME", "Lombard")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+# --- Настройки пула ---
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # сек. ожидания свободного соединения
+DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))  # проверять SELECT 1, если соединение простаивало дольше
+
+# --- Реплики только для чтения ---
+# "host[:port],host[:port]"; имя БД, пользователь и пароль — как у основного сервера
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", str(DB_POOL_MAX)))
+DB_REPLICA_RETRY_AFTER = float(os.getenv("DB_REPLICA_RETRY_AFTER", "10"))  # сек. не обращаться к недоступной реплике
+
+
+class DatabaseUnavailable(Exception):
+    """Не удалось получить соединение с базой данных."""
+
+
+class PoolExhausted(DatabaseUnavailable):
+    """Все соединения пула заняты: сервер жив, но свободного слота нет."""
+
+
+class _Server:
+    """Пул соединений к одному серверу PostgreSQL и семафор его слотов."""
+
+    def __init__(self, name, host, port, minconn, maxconn):
+        self.name = name
+        self.pool = pool.ThreadedConnectionPool(
+            minconn,
+            maxconn,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=host,
+            port=port,
+            connection_factory=connection_factory()
+        )
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.last_used = {}
+        self.replayed_lsn = 0  # Для реплики: наибольшая увиденная позиция воспроизведения WAL
+        self.down_until = 0.0  # Для реплики: до этого момента (monotonic) к ней не обращаемся
+
+
+def _replica_address(address, index):
+    host, _, port = address.partition(":")
+    return f"replica-{index}", host, port or DB_PORT
+
+
+def _connect_servers():
+    """Основной пул и пулы реплик: (primary, replicas)."""
+    primary = _Server("primary", DB_HOST, DB_PORT, DB_POOL_MIN, DB_POOL_MAX)
+    # Реплики подключаются лениво: недоступная реплика не мешает старту воркера
+    replicas = [
+        _Server(*_replica_address(address, index), 0, DB_REPLICA_POOL_MAX)
+        for index, address in enumerate(DB_REPLICA_HOSTS)
+    ]
+    return primary, replicas
+
+
+# Пулы текущего процесса. Соединения, унаследованные от родителя, просто
+# забываем: закрытие в дочернем процессе оборвало бы сессию родителя.
+_servers = ProcessLocal(_connect_servers)
+_replica_turn = itertools.count()
+
+
+def replicas_enabled():
+    return bool(DB_REPLICA_HOSTS)
+
+
+def parse_lsn(text):
+    """Позиция WAL из текстового вида pg_lsn ('16/B374D848') в число; ValueError при ошибке."""
+    high, low = text.split("/")
+    if not (0 < len(high) <= 8 and 0 < len(low) <= 8):
+        raise ValueError(f"Некорректная позиция WAL: {text}")
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def format_lsn(lsn):
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+
+
+def write_position(conn):
+    """
+    Позиция WAL основного сервера после commit (число; 0, если реплик нет).
+
+    Вызывать на соединении, только что зафиксировавшем запись: читатель,
+    которому передана эта позиция, не получит реплику, где записи ещё нет.
+    """
+    if not replicas_enabled():
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_current_wal_lsn()::text")
+        lsn = parse_lsn(cur.fetchone()[0])
+    conn.rollback()
+    return lsn
+
+
+def _is_healthy(server, conn):
+    """Проверка соединения при выдаче из пула."""
+    if conn.closed:
+        return False
+    if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    last_used = server.last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_PING_INTERVAL:
+        # Только что созданное или недавно использованное соединение не пингуем
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout(server):
+    """Берёт из пула живое соединение, заменяя сломанные новыми."""
+    for _ in range(server.pool.maxconn + 1):
+        conn = server.pool.getconn()
+        if _is_healthy(server, conn):
+            return conn
+        server.pool.putconn(conn, close=True)
+        server.last_used.pop(id(conn), None)
+    raise DatabaseUnavailable("Не удалось получить рабочее соединение из пула")
+
+
+def _release(server, conn, broken):
+    """Возвращает соединение в пул; сломанное закрывается и будет пересоздано."""
+    if not broken and not conn.closed:
+        status = conn.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            broken = True
+        elif status != extensions.TRANSACTION_STATUS_IDLE:
+            # Обработчик не зафиксировал транзакцию — откатываем, чтобы не отдать её следующему запросу
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+    broken = broken or conn.closed
+    if broken:
+        server.last_used.pop(id(conn), None)
+    else:
+        server.last_used[id(conn)] = time.monotonic()
+    server.pool.putconn(conn, close=broken)
+
+
+@contextmanager
+def _lease(server, timeout=None):
+    """
+    Соединение из пула сервера на время блока with (DatabaseUnavailable, если не выдать).
+
+    timeout — сколько ждать свободного слота (по умолчанию DB_POOL_TIMEOUT);
+    не дождались — PoolExhausted.
+    """
+    wait_started = time.perf_counter()
+    if not server.slots.acquire(timeout=DB_POOL_TIMEOUT if timeout is None else timeout):
+        if timeout is None:
+            print(f"Ошибка подключения к базе данных ({server.name}): пул соединений исчерпан")
+        raise PoolExhausted("Пул соединений исчерпан")
+    try:
+        try:
+            conn = _checkout(server)
+        except psycopg2.Error as e:
+            print(f"Ошибка подключения к базе данных ({server.name}): {e}")
+            raise DatabaseUnavailable(str(e)) from e
+        # Ожидание свободного слота плюс выдача соединения (с пингом или переподключением)
+        waited = time.perf_counter() - wait_started
+        DB_POOL_WAIT.observe(waited)
+        add_phase_time("db-pool", waited)
+        DB_CONNECTIONS_IN_USE.inc()
+
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            DB_CONNECTIONS_IN_USE.dec()
+            _release(server, conn, broken)
+    finally:
+        server.slots.release()
+
+
+def _next_replica(replicas):
+    """Следующая по кругу реплика, не помеченная недоступной, или None."""
+    now = time.monotonic()
+    for _ in range(len(replicas)):
+        replica = replicas[next(_replica_turn) % len(replicas)]
+        if replica.down_until <= now:
+            return replica
+    return None
+
+
+def _caught_up(replica, conn, min_lsn):
+    """Воспроизвела ли реплика WAL до min_lsn (позиция только растёт — её запоминаем)."""
+    if min_lsn <= replica.replayed_lsn:
+        return True
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_last_wal_replay_lsn()::text")
+        replayed = cur.fetchone()[0]
+    conn.rollback()
+    if replayed is None:
+        # Сервер не в режиме восстановления — это не реплика, позиция неизвестна
+        return False
+    replica.replayed_lsn = max(replica.replayed_lsn, parse_lsn(replayed))
+    return replica.replayed_lsn >= min_lsn
+
+
+@contextmanager
+def get_db_connection(readonly=False, min_lsn=0):
+    """
+    Выдаёт соединение из пула на время блока with и гарантированно возвращает его.
+
+    readonly=True — блок только читает, и его можно выполнить на реплике,
+    уже воспроизведшей WAL до min_lsn (см. write_position).
+    Если соединение получить не удалось, выбрасывает DatabaseUnavailable.
+    """
+    try:
+        primary, replicas = _servers.get()
+    except psycopg2.Error as e:
+        print(f"Ошибка подключения к базе данных: {e}")
+        raise DatabaseUnavailable(str(e)) from e
+
+    if readonly and replicas:
+        replica = _next_replica(replicas)
+        route = "primary-no-replica"
+        served = False
+        if replica is not None:
+            try:
+                # Слот реплики не ждём: занятый пул — не повод задерживать чтение
+                with _lease(replica, timeout=0) as conn:
+                    if _caught_up(replica, conn, min_lsn):
+                        DB_READ_ROUTES.inc("replica")
+                        served = True
+                        yield conn
+                        return
+                route = "primary-lag"
+            except PoolExhausted:
+                if served:
+                    raise
+                # Реплика исправна, просто занята — недоступной её не помечаем
+                route = "primary-busy"
+            except (DatabaseUnavailable, psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if served:
+                    raise
+                # Реплика недоступна — какое-то время читаем с основного сервера
+                print(f"Реплика {replica.name} недоступна, чтение с основного сервера: {e}")
+                replica.down_until = time.monotonic() + DB_REPLICA_RETRY_AFTER
+                route = "primary-fallback"
+        DB_READ_ROUTES.inc(route)
+
+    with _lease(primary) as conn:
+        yield conn
+
+
+def close_pool():
+    """Закрывает все соединения пулов текущего процесса."""
+    servers = _servers.pop()
+    if servers is not None:
+        primary, replicas = servers
+        for server in [primary] + replicas:
+            server.pool.closeall()
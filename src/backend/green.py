@@ -0,0 +1,72 @@
+# backend/green.py
+"""
+Помощники для режима кооперативных воркеров (WORKER_MODE=gevent).
+
+В этом режиме gunicorn подменяет threading и socket на версии gevent,
+а psycopg2 переключается на ожидание через хаб (psycogreen, см.
+gunicorn.conf.py). Ожидание БД и сети больше не держит воркер, но
+CPU-работа в гринлете останавливает все запросы воркера, поэтому bcrypt
+и синхронная отрисовка PDF уходят в настоящие потоки ОС.
+
+В режимах sync/gthread функции отсюда ведут себя как обычный код.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+WORKER_MODE = os.getenv("WORKER_MODE", "sync")  # Тот же параметр, что в gunicorn.conf.py
+
+
+def is_green():
+    """True, если процесс работает под gevent с подменённым threading."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def concurrent_requests():
+    """
+    Сколько запросов воркер обслуживает одновременно (None — ограничение задаёт только память).
+
+    В режиме sync — один: долгий ответ (SSE) занял бы весь процесс воркера.
+    """
+    if is_green():
+        return None
+    if WORKER_MODE == "gthread":
+        return int(os.getenv("GUNICORN_THREADS", "8"))
+    return 1
+
+
+def thread_pool_executor(max_workers, thread_name_prefix=""):
+    """
+    Пул для CPU-работы, которая отпускает GIL (bcrypt, argon2).
+
+    Под gevent обычный ThreadPoolExecutor запускал бы задачи в гринлетах,
+    поэтому берётся пул gevent на настоящих потоках с тем же интерфейсом.
+    """
+    if is_green():
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+        return GeventThreadPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+
+def run_blocking(fn, *args):
+    """Выполняет fn(*args) в потоке ОС под gevent (не блокируя хаб) или просто вызывает его."""
+    if is_green():
+        from gevent import get_hub
+        return get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+
+def spawn(fn, *args):
+    """
+    Под gevent запускает fn(*args) в новом гринлете, иначе вызывает сразу.
+
+    Нужен для колбэков пулов потоков: под gevent они выполняются в хабе,
+    где нельзя ждать ввода-вывода (например, писать в БД).
+    """
+    if is_green():
+        import gevent
+        return gevent.spawn(fn, *args)
+    return fn(*args)
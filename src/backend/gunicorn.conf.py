@@ -0,0 +1,38 @@
+# backend/gunicorn.conf.py
+"""
+Настройки gunicorn; файл подхватывается автоматически при запуске из src/backend.
+
+Режим воркеров выбирается переменной WORKER_MODE:
+    sync   — по умолчанию: один запрос на процесс воркера;
+    gthread — GUNICORN_THREADS потоков на воркер;
+    gevent — кооперативные воркеры: до GEVENT_WORKER_CONNECTIONS одновременных
+             запросов на процесс, psycopg2 ждёт БД через хаб gevent (psycogreen).
+             Нужны пакеты gevent и psycogreen.
+
+Число воркеров и адрес по-прежнему задаются WEB_CONCURRENCY и PORT (или -w / -b).
+"""
+import os
+
+WORKER_MODE = os.getenv("WORKER_MODE", "sync")
+
+if WORKER_MODE == "gevent":
+    worker_class = "gevent"
+    worker_connections = int(os.getenv("GEVENT_WORKER_CONNECTIONS", "1000"))
+elif WORKER_MODE == "gthread":
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "8"))
+elif WORKER_MODE != "sync":
+    raise RuntimeError(f"Неизвестный WORKER_MODE={WORKER_MODE!r}: ожидается sync, gthread или gevent")
+
+
+def post_fork(server, worker):
+    if WORKER_MODE == "gevent":
+        # Ожидание ответа PostgreSQL через хаб gevent, а не блокирующим вызовом libpq
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def worker_exit(server, worker):
+    # Закрываем соединения с PostgreSQL сразу, а не ждём, пока сервер заметит оборванные сессии
+    from db import close_pool
+    close_pool()
@@ -1,7 +1,9 @@
 # backend/hash_passwords.py
+import argparse
 import psycopg2
 import bcrypt
 import os
+import time
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения (данные для подключения к БД)
@@ -19,6 +21,18 @@ HASH_COLUMN = "password_hash"   # Имя нового столбца для хэ
 ID_COLUMN = "id"                # Имя столбца с ID пользователя
 LOGIN_COLUMN = "username"        # Имя столбца с логином (для логов)
 
+def _has_plain_column(cur):
+    """Есть ли в таблице столбец со старыми паролями (в новых базах его нет)."""
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+        (TABLE_NAME, PLAIN_COLUMN)
+    )
+    if cur.fetchone():
+        return True
+    print(f"В таблице {TABLE_NAME} нет столбца {PLAIN_COLUMN} — хэшировать нечего.")
+    return False
+
+
 def hash_existing_passwords():
     conn = None
     cur = None
@@ -40,6 +54,8 @@ def hash_existing_passwords():
         )
         print("Подключение успешно.")
         cur = conn.cursor()
+        if not _has_plain_column(cur):
+            return
 
         # Выбираем пользователей, у которых еще нет хэша (или есть пароль в старом поле)
         # Выбираем id, login и пароль в открытом виде
@@ -59,11 +75,13 @@ def hash_existing_passwords():
         print(f"Найдено {len(users_to_update)} пользователей для хэширования паролей...")
 
         for user_id, login, plain_password in users_to_update:
-            try:
-                if not plain_password: # Пропускаем пустые пароли, если такие есть
-                    print(f"  - Пропущен пользователь ID={user_id}, login='{login}' (пустой пароль)")
-                    continue
+            if not plain_password: # Пропускаем пустые пароли, если такие есть
+                print(f"  - Пропущен пользователь ID={user_id}, login='{login}' (пустой пароль)")
+                continue
 
+            # Точка сохранения: ошибка в одной строке не откатывает уже обновлённые
+            cur.execute("SAVEPOINT hash_user")
+            try:
                 print(f"  - Хэшируем пароль для пользователя ID={user_id}, login='{login}'...")
                 # Хэшируем пароль
                 hashed_password = bcrypt.hashpw(plain_password.encode('utf-8'), bcrypt.gensalt())
@@ -76,14 +94,14 @@ def hash_existing_passwords():
                     WHERE {ID_COLUMN} = %s
                 """
                 cur.execute(update_query, (hashed_password_str, user_id))
+                cur.execute("RELEASE SAVEPOINT hash_user")
                 print(f"    -> Успешно обновлен хэш для ID={user_id}")
                 updated_count += 1
 
             except Exception as e:
                 print(f"    -> ОШИБКА при обработке пользователя ID={user_id}, login='{login}': {e}")
                 error_count += 1
-                conn.rollback() # Откатываем последнее обновление при ошибке
-                # Можно добавить continue, чтобы не пытаться коммитить после ошибки
+                cur.execute("ROLLBACK TO SAVEPOINT hash_user") # Откатываем только обновление этого пользователя
 
         # Фиксируем все успешные изменения
         if updated_count > 0:
@@ -111,5 +129,140 @@ def hash_existing_passwords():
     print(f"Успешно обновлено паролей: {updated_count}")
     print(f"Ошибок при обработке: {error_count}")
 
+# --- Параллельный режим для больших миграций ---
+def _hash_one(args):
+    """Выполняется в процессе пула: (id, пароль, rounds) -> (id, хэш или None, ошибка или None)."""
+    user_id, plain_password, rounds = args
+    if not plain_password:
+        return user_id, None, "пустой пароль"
+    try:
+        hashed = bcrypt.hashpw(plain_password.encode('utf-8'), bcrypt.gensalt(rounds=rounds))
+        return user_id, hashed.decode('utf-8'), None
+    except Exception as e:
+        return user_id, None, str(e)
+
+
+def _format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def hash_existing_passwords_parallel(workers=None, batch_size=1000, rounds=12):
+    """
+    Хэширует пароли на всех ядрах и пишет результат пачками.
+
+    Пользователи читаются порциями по batch_size (keyset по id), хэшируются
+    в пуле процессов и записываются одним execute_values на порцию с commit
+    после каждой. Уже обработанные строки больше не подходят под условие
+    выборки, поэтому прерванный запуск можно просто перезапустить.
+    """
+    from multiprocessing import Pool
+    from psycopg2.extras import execute_values
+
+    if not all([DB_NAME, DB_USER, DB_PASSWORD]):
+        print("Ошибка: Не все переменные окружения для БД (DB_NAME, DB_USER, DB_PASSWORD) заданы в файле .env")
+        return
+
+    workers = workers or os.cpu_count() or 1
+    updated_count = 0
+    error_count = 0
+    conn = None
+    try:
+        print(f"Подключение к базе данных '{DB_NAME}' на '{DB_HOST}:{DB_PORT}'...")
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        cur = conn.cursor()
+        if not _has_plain_column(cur):
+            return
+
+        pending_condition = f"{PLAIN_COLUMN} IS NOT NULL AND ({HASH_COLUMN} IS NULL OR {HASH_COLUMN} = '')"
+        cur.execute(f"SELECT count(*) FROM {TABLE_NAME} WHERE {pending_condition}")
+        total = cur.fetchone()[0]
+        conn.commit()
+        if not total:
+            print("Не найдено пользователей для обновления паролей.")
+            return
+        print(f"Найдено {total} пользователей; процессов: {workers}, размер пачки: {batch_size}, cost: {rounds}")
+
+        select_query = f"""
+            SELECT {ID_COLUMN}, {PLAIN_COLUMN}
+            FROM {TABLE_NAME}
+            WHERE {ID_COLUMN} > %s AND {pending_condition}
+            ORDER BY {ID_COLUMN}
+            LIMIT %s
+        """
+        update_query = f"""
+            UPDATE {TABLE_NAME} AS t
+            SET {HASH_COLUMN} = v.hash
+            FROM (VALUES %s) AS v(id, hash)
+            WHERE t.{ID_COLUMN} = v.id
+        """
+
+        started = time.monotonic()
+        processed = 0
+        last_id = None
+        with Pool(processes=workers) as pool:
+            while True:
+                cur.execute(select_query, (last_id if last_id is not None else -2**63, batch_size))
+                batch = cur.fetchall()
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+
+                results = pool.map(_hash_one, [(user_id, plain, rounds) for user_id, plain in batch], chunksize=16)
+                rows = [(user_id, hashed) for user_id, hashed, error in results if hashed]
+                for user_id, _, error in results:
+                    if error:
+                        error_count += 1
+                        print(f"  - ОШИБКА для пользователя ID={user_id}: {error}")
+                if rows:
+                    execute_values(cur, update_query, rows, page_size=len(rows))
+                conn.commit() # Контрольная точка: пачка сохранена, при перезапуске её не будет в выборке
+                updated_count += len(rows)
+
+                processed += len(batch)
+                elapsed = time.monotonic() - started
+                rate = processed / elapsed if elapsed else 0.0
+                eta = (total - processed) / rate if rate else 0.0
+                print(f"Обработано {processed}/{total} ({rate:.1f} хэшей/с, осталось ~{_format_eta(eta)})")
+
+    except psycopg2.Error as e:
+        print(f"Ошибка базы данных: {e}")
+        if conn:
+            conn.rollback() # Откатывается только текущая пачка, предыдущие уже зафиксированы
+    except KeyboardInterrupt:
+        print("Прервано. Сохранённые пачки остаются в базе, запустите скрипт ещё раз для продолжения.")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+            print("Соединение с базой данных закрыто.")
+
+    print("\n--- Итоги ---")
+    print(f"Успешно обновлено паролей: {updated_count}")
+    print(f"Ошибок при обработке: {error_count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Хэширование паролей существующих пользователей")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Параллельный режим: пул процессов, запись пачками, возобновление после прерывания")
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов (по умолчанию — все ядра)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Пользователей в одной пачке/транзакции")
+    parser.add_argument("--rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", "12")), help="Стоимость bcrypt")
+    args = parser.parse_args()
+
+    if args.parallel:
+        hash_existing_passwords_parallel(args.workers, args.batch_size, args.rounds)
+    else:
+        hash_existing_passwords()
+
+
 if __name__ == "__main__":
-    hash_existing_passwords()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,77 @@
+# backend/json_provider.py
+"""
+JSON-провайдер Flask на orjson.
+
+orjson кодирует в 5-10 раз быстрее стандартного json и сразу отдаёт
+байты, поэтому jsonify() не собирает промежуточную строку. Decimal
+отдаётся числом, дата и время — в ISO 8601. Ответы всегда компактные:
+в режиме отладки Flask иначе включал бы отступы.
+
+orjson указан в requirements.txt; если его не удалось установить (нет
+wheel для платформы), используется стандартный json с теми же правилами
+преобразования, и в журнал пишется предупреждение.
+"""
+import dataclasses
+import decimal
+import uuid
+from datetime import date, datetime, time
+from time import perf_counter
+
+from flask.json.provider import DefaultJSONProvider
+
+from metrics import add_phase_time
+
+try:
+    import orjson
+except ImportError:
+    print("Предупреждение: orjson не установлен, JSON кодируется стандартным модулем json")
+    orjson = None
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _default(obj):
+    """Типы, которые не сериализуются напрямую (для orjson — только Decimal и set)."""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Провайдер для app.json: orjson, если установлен, иначе стандартный json."""
+
+    default = staticmethod(_default)
+    sort_keys = False  # Порядок ключей как в словаре (например, как в списке полей каталога)
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Время сериализации попадает в Server-Timing и метрики (этап serialize)
+        started = perf_counter()
+        if orjson is None:
+            response = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            body = orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+            response = self._app.response_class(body, mimetype=self.mimetype)
+        add_phase_time("serialize", perf_counter() - started)
+        return response
@@ -0,0 +1,281 @@
+# backend/metrics.py
+"""
+Метрики запросов и БД в текстовом формате Prometheus.
+
+- init_app(app) — задержка и статусы по маршрутам, заголовок Server-Timing
+  с разбивкой времени запроса (ожидание пула, SQL, сериализация);
+- TimedConnection — класс соединения psycopg2 (connection_factory): считает
+  открытые соединения и время каждого SQL-запроса, медленные запросы пишет в лог;
+- render() — все метрики для эндпоинта /metrics.
+
+Метрики свои у каждого воркера gunicorn (как и кэши): /metrics показывает
+воркер, который обработал запрос, а метка pid позволяет их различить.
+Накладные расходы — пара вызовов perf_counter и короткая блокировка на
+наблюдение, поэтому инструментацию можно не выключать в продакшене.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from psycopg2 import extensions
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))  # Запросы дольше пишутся в лог
+SLOW_QUERY_LOG_CHARS = 500  # Сколько символов SQL показывать в логе
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_request_phases = threading.local()
+
+
+class Counter:
+    """Счётчик с метками."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Значение, которое может и расти, и уменьшаться."""
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (как в prometheus_client)."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [счётчики по корзинам..., +Inf, сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(labels, list(counts)) for labels, counts in self._values.items()]
+        result = []
+        for labels, counts in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else repr(float(bound))
+                result.append((f"{self.name}_bucket", labels + (("le", le),), cumulative))
+            result.append((f"{self.name}_sum", labels, counts[-1]))
+            result.append((f"{self.name}_count", labels, cumulative))
+        return result
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route"))
+REQUESTS_TOTAL = Counter(
+    "http_requests_total", "HTTP-запросы по статусу ответа", ("method", "route", "status"))
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запроса", ("statement",))
+DB_SLOW_QUERIES = Counter(
+    "db_slow_queries_total", "SQL-запросы дольше SLOW_QUERY_MS", ("statement",))
+DB_CONNECTIONS_OPENED = Counter(
+    "db_connections_opened_total", "Открытые соединения с PostgreSQL")
+DB_CONNECTIONS_IN_USE = Gauge(
+    "db_connections_in_use", "Соединения, выданные из пула обработчикам")
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Ожидание соединения из пула")
+PHASE_LATENCY = Histogram(
+    "app_phase_duration_seconds", "Время отдельных этапов обработки запроса", ("phase",))
+DB_READ_ROUTES = Counter(
+    "db_read_routes_total", "Чтения только для чтения по месту выполнения", ("target",))
+
+_METRICS = [
+    REQUEST_LATENCY, REQUESTS_TOTAL, DB_QUERY_LATENCY, DB_SLOW_QUERIES,
+    DB_CONNECTIONS_OPENED, DB_CONNECTIONS_IN_USE, DB_POOL_WAIT, PHASE_LATENCY, DB_READ_ROUTES
+]
+_collectors = []  # Функции, возвращающие [(имя, тип, справка, значение)] на момент сбора
+
+
+def add_phase_time(phase, seconds):
+    """Учитывает время этапа в гистограмме и в Server-Timing текущего запроса."""
+    if not METRICS_ENABLED:
+        return
+    PHASE_LATENCY.observe(seconds, phase)
+    phases = getattr(_request_phases, "values", None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def _statement_kind(query):
+    """Первое слово SQL (SELECT, UPDATE, ...) — метка с ограниченным числом значений."""
+    if isinstance(query, bytes):
+        query = query[:32].decode("utf-8", errors="ignore")
+    elif not isinstance(query, str):
+        return "OTHER"
+    words = query.lstrip(" \t\r\n(").split(None, 1)
+    return words[0].upper() if words and words[0].isalpha() else "OTHER"
+
+
+def _record_query(cursor, query, started):
+    elapsed = time.perf_counter() - started
+    # cursor.query — фактически отправленный SQL (после подстановки параметров и sql.Composed)
+    sent = cursor.query if cursor.query is not None else query
+    kind = _statement_kind(sent)
+    DB_QUERY_LATENCY.observe(elapsed, kind)
+    add_phase_time("db", elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc(kind)
+        if isinstance(sent, bytes):
+            sent = sent.decode("utf-8", errors="replace")
+        elif not isinstance(sent, str):
+            sent = str(sent)
+        print(f"Медленный SQL-запрос ({elapsed * 1000:.0f} мс): {' '.join(sent.split())[:SLOW_QUERY_LOG_CHARS]}")
+
+
+class _TimedCursorMixin:
+    """Замеряет execute/executemany/copy_expert у любого класса курсора psycopg2."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record_query(self, query, started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record_query(self, query, started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _record_query(self, sql, started)
+
+
+_timed_cursor_classes = {}
+_timed_cursor_lock = threading.Lock()
+
+
+def _timed_cursor_class(base):
+    """Подкласс курсора base с замером запросов (DictCursor -> TimedDictCursor и т.п.)."""
+    cls = _timed_cursor_classes.get(base)
+    if cls is None:
+        with _timed_cursor_lock:
+            cls = _timed_cursor_classes.get(base)
+            if cls is None:
+                cls = type(f"Timed{base.__name__}", (_TimedCursorMixin, base), {})
+                _timed_cursor_classes[base] = cls
+    return cls
+
+
+class TimedConnection(extensions.connection):
+    """Соединение, которое считает себя в метриках и выдаёт замеряющие курсоры."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        DB_CONNECTIONS_OPENED.inc()
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = _timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+def connection_factory():
+    """Класс соединения для psycopg2.connect / пула (None — обычное соединение)."""
+    return TimedConnection if METRICS_ENABLED else None
+
+
+def register_collector(collect):
+    """Добавляет функцию, значения которой снимаются в момент запроса /metrics."""
+    _collectors.append(collect)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name, label_names, labels, value, pid):
+    # Значения меток без имени сопоставляются с label_names по порядку, пары (имя, значение) — как есть
+    plain = [item for item in labels if not isinstance(item, tuple)]
+    pairs = [("pid", pid)] + list(zip(label_names, plain)) + [item for item in labels if isinstance(item, tuple)]
+    rendered = ",".join(f'{key}="{_escape(val)}"' for key, val in pairs)
+    return f"{name}{{{rendered}}} {value}"
+
+
+def render():
+    """Все метрики процесса в текстовом формате Prometheus 0.0.4."""
+    pid = os.getpid()
+    lines = []
+    for metric in _METRICS:
+        kind = "histogram" if isinstance(metric, Histogram) else "gauge" if isinstance(metric, Gauge) else "counter"
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        for name, labels, value in metric.samples():
+            lines.append(_format_sample(name, metric.label_names, labels, value, pid))
+    for collect in _collectors:
+        try:
+            samples = collect()
+        except Exception as e:
+            print(f"Ошибка при сборе метрик: {e}")
+            continue
+        for name, kind, help_text, value in samples:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(_format_sample(name, (), (), value, pid))
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    """Подключает замер задержки по маршрутам и Server-Timing к приложению Flask."""
+    if not METRICS_ENABLED:
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+        _request_phases.values = {}
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("metrics_started", None)
+        phases = getattr(_request_phases, "values", None) or {}
+        _request_phases.values = None
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        # Шаблон маршрута, а не путь: /api/products/<int:product_id> — одна серия, а не тысячи
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        REQUEST_LATENCY.observe(elapsed, request.method, route)
+        REQUESTS_TOTAL.inc(request.method, route, str(response.status_code))
+        for phase, seconds in phases.items():
+            response.headers.add("Server-Timing", f"{phase};dur={seconds * 1000:.1f}")
+        response.headers.add("Server-Timing", f"total;dur={elapsed * 1000:.1f}")
+        return response
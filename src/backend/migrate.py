@@ -0,0 +1,164 @@
+# backend/migrate.py
+"""
+Версионные миграции схемы БД.
+
+Миграции — SQL-файлы в каталоге migrations/ вида NNNN_описание.sql.
+Применённые версии записываются в таблицу schema_migrations, каждая
+миграция выполняется в своей транзакции. На время прогона берётся
+advisory-блокировка, поэтому два одновременных деплоя не применят
+одну миграцию дважды.
+
+Запуск вручную: python migrate.py [--verify-only]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE_RE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+MIGRATION_LOCK_ID = 741302  # Ключ pg_advisory_lock, общий для всех процессов деплоя
+
+# Горячие запросы приложения и индексы, которыми они должны обслуживаться
+HOT_QUERIES = [
+    ("Вход / регистрация",
+     "SELECT id, password_hash, role FROM users WHERE username = 'x'",
+     "users_username_key"),
+    ("PDF-отчёт по броням",
+     "SELECT id, name, price FROM products WHERE is_booked = TRUE ORDER BY name",
+     "products_booked_name_idx"),
+    ("Каталог (страница по курсору)",
+     "SELECT id, name, price, is_booked, image_url FROM products WHERE id > 0 ORDER BY id LIMIT 50",
+     "products_pkey"),
+    ("Поиск: словоформы",
+     "SELECT id FROM products WHERE name_tsv @@ websearch_to_tsquery('russian', 'кольца')",
+     "products_name_tsv_idx"),
+    ("Поиск: подстрока / опечатки",
+     "SELECT id FROM products WHERE name ILIKE '%кольц%'",
+     "products_name_trgm_idx"),
+]
+
+
+def list_migrations():
+    """Список (версия, имя, путь) в порядке версий."""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError("В каталоге migrations есть повторяющиеся номера версий")
+    return migrations
+
+
+def _applied_versions(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def run_migrations(conn):
+    """Применяет ещё не применённые миграции; возвращает список применённых версий."""
+    conn.autocommit = False
+    applied_now = []
+    with conn.cursor() as cur:
+        # Блокировка уровня сессии: держится между транзакциями отдельных миграций
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        with conn.cursor() as cur:
+            applied = _applied_versions(cur)
+        conn.commit()
+
+        for version, name, path in list_migrations():
+            if version in applied:
+                continue
+            with open(path, encoding="utf-8") as f:
+                statements = f.read()
+            print(f"Применение миграции {version:04d}_{name}...")
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(statements)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name)
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                print(f"ОШИБКА в миграции {version:04d}_{name}, изменения откатены")
+                raise
+            applied_now.append(version)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+    return applied_now
+
+
+def _plan_indexes(plan):
+    """Имена индексов из всех узлов плана EXPLAIN (FORMAT JSON)."""
+    names = set()
+    if "Index Name" in plan:
+        names.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        names |= _plan_indexes(child)
+    return names
+
+
+def verify_hot_queries(conn):
+    """
+    Проверяет через EXPLAIN, что горячие запросы могут идти по индексу.
+
+    На маленькой таблице планировщик честно выберет Seq Scan, поэтому
+    последовательное сканирование на время проверки запрещается: если
+    нужного индекса нет или он не подходит к запросу, план всё равно
+    его не покажет. Возвращает список запросов без индекса.
+    """
+    failed = []
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for title, query, index_name in HOT_QUERIES:
+            cur.execute("EXPLAIN (FORMAT JSON) " + query)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = _plan_indexes(plan[0]["Plan"])
+            if index_name in used:
+                print(f"  OK: {title} — {index_name}")
+            else:
+                print(f"  НЕТ ИНДЕКСА: {title} — ожидался {index_name}, в плане: {', '.join(sorted(used)) or 'Seq Scan'}")
+                failed.append(title)
+    conn.rollback()
+    return failed
+
+
+def main():
+    from db import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+
+    parser = argparse.ArgumentParser(description="Миграции схемы БД Lombard")
+    parser.add_argument("--verify-only", action="store_true", help="Только проверить индексы горячих запросов")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    try:
+        if not args.verify_only:
+            applied = run_migrations(conn)
+            print(f"Применено миграций: {len(applied)}")
+        print("Проверка индексов горячих запросов:")
+        return 1 if verify_hot_queries(conn) else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+-- Базовая схема: таблицы, которые раньше создавались вручную.
+-- IF NOT EXISTS — чтобы миграция спокойно применялась к уже существующей базе.
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL,
+    password_hash TEXT,
+    role TEXT NOT NULL DEFAULT 'user',
+    full_name TEXT,
+    phone_number TEXT,
+    email TEXT
+);
+
+CREATE TABLE IF NOT EXISTS products (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    price NUMERIC(12, 2) NOT NULL CHECK (price >= 0),
+    is_booked BOOLEAN NOT NULL DEFAULT FALSE,
+    image_url TEXT
+);
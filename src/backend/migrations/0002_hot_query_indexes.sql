@@ -0,0 +1,14 @@
+-- Индексы под горячие запросы.
+-- Имена совпадают с теми, что PostgreSQL дал бы ограничениям UNIQUE(username) / UNIQUE(email),
+-- поэтому на базе, где такие ограничения уже есть, повторно ничего не создаётся.
+
+-- Вход и регистрация: WHERE username = %s
+CREATE UNIQUE INDEX IF NOT EXISTS users_username_key ON users (username);
+
+-- Регистрация: уникальность email
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_key ON users (email);
+
+-- PDF-отчёт: WHERE is_booked = TRUE ORDER BY name — частичный индекс только по забронированным
+CREATE INDEX IF NOT EXISTS products_booked_name_idx ON products (name) WHERE is_booked;
+
+-- Каталог: ORDER BY id / WHERE id > курсор обслуживает первичный ключ products_pkey
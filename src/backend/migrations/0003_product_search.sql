@@ -0,0 +1,14 @@
+-- Поиск товаров по названию (/api/products/search).
+-- pg_trgm — нечёткое совпадение и подстроки (опечатки, «кольц»),
+-- tsvector с русским словарём — словоформы («кольца» находит «кольцо»).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS products_name_trgm_idx ON products USING gin (name gin_trgm_ops);
+
+-- Вычисляемый столбец (PostgreSQL 12+): обновляется вместе с name, код приложения его не пишет
+ALTER TABLE products
+    ADD COLUMN IF NOT EXISTS name_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', name)) STORED;
+
+CREATE INDEX IF NOT EXISTS products_name_tsv_idx ON products USING gin (name_tsv);
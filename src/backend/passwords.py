@@ -0,0 +1,196 @@
+# backend/passwords.py
+"""
+Хэширование и проверка паролей в отдельном ограниченном пуле потоков.
+
+bcrypt и argon2 отпускают GIL на время вычисления, поэтому пул потоков
+реально разгружает обработчики. Если все потоки заняты и очередь заполнена,
+вызов сразу завершается HashingOverloaded — обработчик отвечает 503,
+а не копит запросы, из-за которых встанет и остальной трафик.
+
+Политика хэширования (PASSWORD_SCHEME, BCRYPT_ROUNDS, ARGON2_*) может
+меняться: хэши, которые ей не соответствуют, пересчитываются в фоне после
+успешного входа (см. schedule_rehash).
+"""
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import bcrypt
+
+from green import spawn, thread_pool_executor
+from process_local import ProcessLocal
+
+try:
+    import argon2  # Необязательная зависимость: pip install argon2-cffi
+except ImportError:
+    argon2 = None
+
+PASSWORD_SCHEME = os.getenv("PASSWORD_SCHEME", "bcrypt")  # bcrypt | argon2
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "19456"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_HASH_QUEUE = int(os.getenv("AUTH_HASH_QUEUE", "4"))      # Сколько вызовов может ждать свободный поток
+AUTH_HASH_TIMEOUT = float(os.getenv("AUTH_HASH_TIMEOUT", "5"))  # сек. ожидания результата
+
+
+class HashingOverloaded(Exception):
+    """Пул хэширования перегружен — запрос нужно отклонить (503)."""
+
+
+if PASSWORD_SCHEME == "argon2" and argon2 is None:
+    print("WARNING: PASSWORD_SCHEME=argon2, but argon2-cffi is not installed. Falling back to bcrypt.")
+    PASSWORD_SCHEME = "bcrypt"
+
+_argon2_hasher = None
+if argon2 is not None:
+    _argon2_hasher = argon2.PasswordHasher(
+        time_cost=ARGON2_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM
+    )
+
+
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "rejected": 0, "seconds_total": 0.0}
+_request_time = threading.local()
+
+
+def _new_pool():
+    """Пул потоков и семафор его очереди: (executor, slots)."""
+    # Под gevent — пул на настоящих потоках, иначе bcrypt остановил бы весь воркер
+    executor = thread_pool_executor(AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return executor, threading.BoundedSemaphore(AUTH_HASH_WORKERS + AUTH_HASH_QUEUE)
+
+
+_pool = ProcessLocal(_new_pool)
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def _run(fn, *args):
+    executor, slots = _pool.get()
+    if not slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["rejected"] += 1
+        raise HashingOverloaded("Пул хэширования паролей перегружен")
+    try:
+        future = executor.submit(_timed, fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    # Слот освобождается, когда вычисление действительно закончилось, даже если мы перестали ждать
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        result, elapsed = future.result(timeout=AUTH_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        with _stats_lock:
+            _stats["rejected"] += 1
+        raise HashingOverloaded("Хэширование пароля не уложилось в таймаут")
+
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["seconds_total"] += elapsed
+    _request_time.seconds = getattr(_request_time, "seconds", 0.0) + elapsed
+    return result
+
+
+def _hash(password):
+    if PASSWORD_SCHEME == "argon2":
+        return _argon2_hasher.hash(password)
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def _verify(password, password_hash):
+    if password_hash.startswith("$argon2"):
+        if _argon2_hasher is None:
+            raise RuntimeError("Хэш argon2 не проверить: argon2-cffi не установлен")
+        try:
+            return _argon2_hasher.verify(password_hash, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHash):
+            return False
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def hash_password(password):
+    """Хэширует пароль по текущей политике (PASSWORD_SCHEME); возвращает строку."""
+    return _run(_hash, password)
+
+
+def check_password(password, password_hash):
+    """Сравнивает пароль с сохранённым хэшем (bcrypt или argon2 — по префиксу)."""
+    return _run(_verify, password, password_hash)
+
+
+def needs_rehash(password_hash):
+    """True, если хэш сделан не той схемой или с другой стоимостью, чем требует политика."""
+    if PASSWORD_SCHEME == "argon2":
+        if not password_hash.startswith("$argon2"):
+            return True
+        try:
+            return _argon2_hasher.check_needs_rehash(password_hash)
+        except argon2.exceptions.InvalidHash:
+            return True
+    if not password_hash.startswith("$2"):
+        return True
+    # Формат bcrypt: $2b$<cost>$<salt+hash>
+    try:
+        cost = int(password_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return True
+    # Пересчитываем и более слабые, и более дорогие хэши — политика задаёт баланс задержки и стойкости
+    return cost != BCRYPT_ROUNDS
+
+
+def schedule_rehash(password, save):
+    """
+    Пересчитывает хэш по текущей политике в фоне и передаёт его в save(new_hash).
+
+    Не ждёт результата и не занимает поток запроса. Если пул занят,
+    пересчёт просто пропускается — он повторится при следующем входе.
+    """
+    executor, slots = _pool.get()
+    if not slots.acquire(blocking=False):
+        return False
+
+    def save_new_hash(new_hash):
+        try:
+            save(new_hash)
+        except Exception as e:
+            print(f"Ошибка при фоновом пересчёте хэша пароля: {e}")
+
+    def on_done(future):
+        slots.release()
+        error = future.exception()
+        if error is not None:
+            print(f"Ошибка при фоновом пересчёте хэша пароля: {error}")
+            return
+        # Запись в БД — вне хаба gevent (в sync-режиме просто в потоке пула)
+        spawn(save_new_hash, future.result())
+
+    try:
+        future = executor.submit(_hash, password)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(on_done)
+    return True
+
+
+def pop_request_hash_time():
+    """Время хэширования в текущем потоке с прошлого вызова (для Server-Timing)."""
+    seconds = getattr(_request_time, "seconds", 0.0)
+    _request_time.seconds = 0.0
+    return seconds
+
+
+def hashing_stats():
+    """Счётчики пула: успешные вызовы, отказы, суммарное время."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,44 @@
+# backend/process_local.py
+"""
+Объекты «один на процесс»: пулы соединений, пулы процессов и потоков, хабы.
+
+gunicorn создаёт воркеры через fork, и унаследованные от мастера пулы,
+потоки и открытые файлы в дочернем процессе не работают (или мешают
+родителю). ProcessLocal создаёт значение при первом обращении и заново —
+в каждом новом процессе; старое значение родителя просто забывается.
+"""
+import os
+import threading
+
+
+class ProcessLocal:
+    """Лениво созданное factory() значение, своё у каждого процесса."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            # Блокировку мог держать другой поток родителя: в потомке она осталась бы занятой навсегда
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._value = self._factory()
+                    self._pid = pid
+        return self._value
+
+    def pop(self):
+        """Забывает значение; возвращает его, если оно создано в этом процессе (например, чтобы закрыть)."""
+        with self._lock:
+            value = self._value if self._pid == os.getpid() else None
+            self._value = None
+            self._pid = None
+        return value
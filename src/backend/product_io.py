@@ -0,0 +1,193 @@
+# backend/product_io.py
+"""
+Валидация товаров, потоковый импорт (CSV / NDJSON -> COPY FROM STDIN)
+и потоковый экспорт каталога.
+
+Строки обрабатываются по одной, поэтому память не зависит от размера
+загружаемого или выгружаемого каталога.
+"""
+import codecs
+import csv
+import io
+import json
+import math
+import zlib
+
+# Сколько ошибок по строкам возвращать клиенту (считаются все)
+IMPORT_MAX_REPORTED_ERRORS = 100
+# products.price — NUMERIC(12, 2): цена после округления до копеек должна быть меньше 10^10
+PRICE_MAX = 10 ** 10
+
+IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonlines': 'ndjson',
+}
+
+
+def validate_product(name, price, image_url):
+    """
+    Проверяет поля товара по тем же правилам, что и POST /api/products.
+
+    Возвращает (name, price, image_url) с ценой, приведённой к float и
+    округлённой до копеек, или выбрасывает ValueError с сообщением для клиента.
+    """
+    if not name or price is None or price == '':
+        raise ValueError("Необходимо указать название и цену товара")
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        raise ValueError("Цена должна быть числом")
+    if not math.isfinite(price):
+        raise ValueError("Цена должна быть числом")
+    if price < 0:
+        raise ValueError("Цена не может быть отрицательной")
+    price = round(price, 2)
+    if price >= PRICE_MAX:
+        raise ValueError(f"Цена должна быть меньше {PRICE_MAX}")
+    return name, price, image_url or None
+
+
+# Сообщения об ошибках разбора строки (вместо словаря строки отдаётся текст ошибки)
+_ROW_MALFORMED = "Некорректная строка"
+_ROW_NOT_UTF8 = "Строка не в кодировке UTF-8"
+
+
+def _iter_csv(stream):
+    """Строки CSV с заголовком name,price,image_url: (номер строки, словарь или текст ошибки)."""
+    # Поток тела запроса итерируется по строкам; декодируем их инкрементально.
+    # Некорректные байты заменяются на U+FFFD, и такая строка отклоняется, а не обрывает импорт.
+    reader = csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig', errors='replace'))
+    for row in reader:
+        if any('\ufffd' in value for value in row.values() if isinstance(value, str)):
+            yield reader.line_num, _ROW_NOT_UTF8
+            continue
+        yield reader.line_num, row
+
+
+def _iter_ndjson(stream):
+    """Строки NDJSON: по одному JSON-объекту на строку."""
+    for line_num, raw in enumerate(stream, start=1):
+        try:
+            raw = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            yield line_num, _ROW_NOT_UTF8
+            continue
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            row = json.loads(raw)
+        except ValueError:
+            yield line_num, _ROW_MALFORMED
+            continue
+        yield line_num, row if isinstance(row, dict) else _ROW_MALFORMED
+
+
+class ImportResult:
+    """Счётчики импорта и ошибки по строкам."""
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line_num, message):
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"row": line_num, "message": message})
+
+
+def iter_valid_products(stream, fmt, result):
+    """
+    Разбирает поток и отдаёт валидные строки как (name, price, image_url).
+
+    Невалидные строки пропускаются и учитываются в result.
+    """
+    rows = _iter_csv(stream) if fmt == 'csv' else _iter_ndjson(stream)
+    for line_num, row in rows:
+        if isinstance(row, str):
+            result.reject(line_num, row)
+            continue
+        try:
+            product = validate_product(row.get('name'), row.get('price'), row.get('image_url'))
+        except ValueError as e:
+            result.reject(line_num, str(e))
+            continue
+        result.accepted += 1
+        yield product
+
+
+def iter_copy_lines(stream, fmt, result):
+    """Валидные строки потока в формате CSV для COPY (см. iter_valid_products)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for name, price, image_url in iter_valid_products(stream, fmt, result):
+        buffer.seek(0)
+        buffer.truncate()
+        # None -> пустое поле без кавычек, COPY ... CSV читает его как NULL
+        writer.writerow([name, repr(price), image_url])
+        yield buffer.getvalue().encode('utf-8')
+
+
+class CopyStream:
+    """Файлоподобный объект для cursor.copy_expert поверх генератора байтовых строк."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+# --- Экспорт каталога ---
+EXPORT_COLUMNS = ('id', 'name', 'price', 'is_booked', 'image_url')
+EXPORT_CHUNK_BYTES = 64 * 1024  # Отдаём клиенту кусками примерно такого размера
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_export_chunks(rows, fmt):
+    """Превращает строки (id, name, price, is_booked, image_url) в куски CSV/NDJSON."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        if fmt == 'csv':
+            writer.writerow(['true' if v is True else 'false' if v is False else v for v in row])
+        else:
+            item = dict(zip(EXPORT_COLUMNS, row))
+            if item['price'] is not None:
+                item['price'] = float(item['price'])
+            buffer.write(json.dumps(item, ensure_ascii=False))
+            buffer.write('\n')
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Сжимает поток кусков в gzip, не накапливая его целиком."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
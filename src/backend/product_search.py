@@ -0,0 +1,60 @@
+# backend/product_search.py
+"""
+Поиск товаров по названию: полнотекстовый (русская морфология) и нечёткий (pg_trgm).
+
+Индексы создаёт миграция 0003_product_search.sql. Условия объединены
+через OR, и каждое обслуживается своим GIN-индексом (BitmapOr), так что
+запрос не сканирует таблицу даже на сотнях тысяч товаров.
+"""
+from thumbnails import THUMBNAIL_URL_SQL
+
+SEARCH_QUERY_MIN = 2
+SEARCH_QUERY_MAX = 100
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+
+# Ранг: совпадение по словоформам весит больше, нечёткое сходство слова добавляет к нему.
+# Готовый JSON собирает PostgreSQL, как и для страниц каталога.
+SEARCH_SQL = """
+    WITH q AS (
+        SELECT websearch_to_tsquery('russian', %(q)s) AS ts
+    ), found AS (
+        SELECT p.id, p.name, p.price, p.is_booked, p.image_url,
+               ts_rank(p.name_tsv, q.ts) * 2 + word_similarity(%(q)s, p.name) AS rank
+        FROM products p, q
+        WHERE p.name_tsv @@ q.ts
+           OR %(q)s <%% p.name
+           OR p.name ILIKE %(contains)s
+        ORDER BY rank DESC, p.id
+        LIMIT %(limit)s
+    )
+    SELECT json_build_object(
+        'items', COALESCE(json_agg(json_build_object(
+            'id', id, 'name', name, 'price', price, 'is_booked', is_booked, 'image_url', image_url,
+            'thumbnail_url', """ + THUMBNAIL_URL_SQL + """
+        ) ORDER BY rank DESC, id), '[]'::json)
+    )::text
+    FROM found
+"""
+
+
+def parse_search_args(args):
+    """Параметры q и limit из query-строки; при ошибке — ValueError с сообщением для клиента."""
+    q = ' '.join((args.get('q') or '').split())
+    if len(q) < SEARCH_QUERY_MIN:
+        raise ValueError(f"Параметр q должен содержать не меньше {SEARCH_QUERY_MIN} символов")
+    if len(q) > SEARCH_QUERY_MAX:
+        raise ValueError(f"Параметр q должен быть не длиннее {SEARCH_QUERY_MAX} символов")
+    try:
+        limit = int(args.get('limit', SEARCH_LIMIT_DEFAULT))
+    except ValueError:
+        raise ValueError("Параметр limit должен быть целым числом")
+    if limit < 1 or limit > SEARCH_LIMIT_MAX:
+        raise ValueError(f"Параметр limit должен быть от 1 до {SEARCH_LIMIT_MAX}")
+    return q, limit
+
+
+def search_params(q, limit):
+    """Параметры для SEARCH_SQL; спецсимволы LIKE в запросе ищутся буквально."""
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return {'q': q, 'contains': f'%{escaped}%', 'limit': limit}
@@ -2,6 +2,9 @@
 """
 Скрипт для проверки и настройки подключения к базе данных при деплое на Render.
 Запускается автоматически при buildCommand в render.yaml
+
+После проверки подключения применяет миграции схемы (см. migrate.py)
+и проверяет, что горячие запросы обслуживаются индексами.
 """
 
 import os
@@ -10,6 +13,8 @@ import psycopg2
 from dotenv import load_dotenv
 import time
 
+from migrate import run_migrations, verify_hot_queries
+
 # Загружаем переменные среды
 load_dotenv()
 
@@ -64,6 +69,36 @@ def check_db_connection():
         print(f"ОШИБКА подключения к БД: {e}")
         return False
 
+def apply_migrations():
+    """Применяет миграции схемы и проверяет индексы горячих запросов"""
+    print("Применение миграций схемы БД...")
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+    except Exception as e:
+        print(f"ОШИБКА подключения к БД: {e}")
+        return False
+
+    try:
+        applied = run_migrations(conn)
+        print(f"Применено миграций: {len(applied)}")
+        print("Проверка индексов горячих запросов:")
+        failed = verify_hot_queries(conn)
+        if failed:
+            print(f"ОШИБКА: запросы без индекса: {', '.join(failed)}")
+            return False
+        return True
+    except Exception as e:
+        print(f"ОШИБКА при применении миграций: {e}")
+        return False
+    finally:
+        conn.close()
+
 def main():
     """Основная функция для проверки и настройки перед деплоем"""
     print("Запуск скрипта подготовки к деплою на Render...")
@@ -74,6 +109,9 @@ def main():
     
     for i in range(max_retries):
         if check_db_connection():
+            if not apply_migrations():
+                print("Подготовка к деплою прервана: схема БД не приведена к актуальной версии.")
+                return 1
             print("Подготовка к деплою успешно завершена!")
             return 0
         else:
@@ -0,0 +1,182 @@
+# backend/report_jobs.py
+"""
+Фоновая генерация PDF-отчётов в пуле процессов и кэш готовых файлов.
+
+Идентификатор задачи — хэш версии каталога и набора забронированных
+товаров, поэтому одинаковый набор рендерится один раз, а повторные
+скачивания без изменений в каталоге отдаются из кэша. Готовый отчёт
+живёт в кэше до первого изменения каталога (новая версия — новый ключ),
+но не дольше REPORT_CACHE_TTL: время формирования, напечатанное в PDF,
+отстаёт от момента скачивания не больше чем на этот срок. Старые файлы
+вытесняются, когда их больше REPORT_CACHE_MAX_FILES. Состояние задачи хранится файлами
+в REPORT_CACHE_DIR, так что опрашивать статус можно через любой воркер
+gunicorn:
+    <id>.pdf      — готовый отчёт
+    <id>.pending  — отчёт рендерится
+    <id>.error    — рендеринг завершился ошибкой
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from process_local import ProcessLocal
+from reports import render_booked_pdf_to_file, warm_up
+
+REPORT_CACHE_DIR = os.getenv(
+    "REPORT_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "lombard_reports")
+)
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_CACHE_MAX_FILES = int(os.getenv("REPORT_CACHE_MAX_FILES", "50"))
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "3600"))  # сек. жизни готового отчёта
+# Маркер .pending старше этого считается брошенным (например, воркер был убит)
+REPORT_JOB_TIMEOUT = float(os.getenv("REPORT_JOB_TIMEOUT", "300"))
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Пул процессов текущего воркера; каждый процесс пула один раз регистрирует шрифт и собирает стили
+_executor = ProcessLocal(lambda: ProcessPoolExecutor(max_workers=REPORT_WORKERS, initializer=warm_up))
+
+
+def _path(job_id, suffix):
+    return os.path.join(REPORT_CACHE_DIR, f"{job_id}.{suffix}")
+
+
+def booked_set_key(booked_items, catalog_version):
+    """Хэш версии каталога и набора забронированных товаров (id, название, цена)."""
+    digest = hashlib.sha256(f"{catalog_version}\x1e".encode("utf-8"))
+    for item in booked_items:
+        digest.update(f"{item['id']}\x1f{item['name']}\x1f{item['price']}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def is_valid_job_id(job_id):
+    return bool(JOB_ID_RE.match(job_id))
+
+
+def _is_fresh(path):
+    try:
+        return time.time() - os.path.getmtime(path) < REPORT_CACHE_TTL
+    except OSError:
+        return False
+
+
+def report_path(job_id):
+    """Путь к готовому PDF или None, если его ещё нет или он старше REPORT_CACHE_TTL."""
+    path = _path(job_id, "pdf")
+    return path if _is_fresh(path) else None
+
+
+def _is_pending(job_id):
+    try:
+        return time.time() - os.path.getmtime(_path(job_id, "pending")) < REPORT_JOB_TIMEOUT
+    except OSError:
+        return False
+
+
+def job_status(job_id):
+    """'done', 'pending', 'failed' или None, если задача неизвестна (или отчёт устарел)."""
+    if _is_fresh(_path(job_id, "pdf")):
+        return "done"
+    if _is_pending(job_id):
+        return "pending"
+    if os.path.exists(_path(job_id, "error")):
+        return "failed"
+    return None
+
+
+def _evict_old_reports():
+    """Оставляет в кэше не больше REPORT_CACHE_MAX_FILES самых свежих отчётов."""
+    try:
+        reports = [
+            entry for entry in os.scandir(REPORT_CACHE_DIR)
+            if entry.name.endswith(".pdf") or entry.name.endswith(".error")
+        ]
+    except OSError:
+        return
+    if len(reports) <= REPORT_CACHE_MAX_FILES:
+        return
+    reports.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in reports[:len(reports) - REPORT_CACHE_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _on_done(job_id, future):
+    try:
+        os.remove(_path(job_id, "pending"))
+    except OSError:
+        pass
+    error = future.exception()
+    if error is not None:
+        print(f"Ошибка при генерации PDF отчета {job_id}: {error}")
+        with open(_path(job_id, "error"), "w", encoding="utf-8") as f:
+            f.write(str(error))
+    _evict_old_reports()
+
+
+def _remove_stale_marker(job_id):
+    """
+    Убирает брошенный маркер .pending, не задевая свежий.
+
+    Маркер сначала переименовывается (это удаётся только одному процессу),
+    и лишь потом проверяется его возраст: если за это время другой запрос
+    успел создать свежий маркер, он возвращается на место.
+    """
+    pending = _path(job_id, "pending")
+    if _is_pending(job_id):
+        return
+    taken = f"{pending}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        os.rename(pending, taken)
+    except OSError:
+        return
+    try:
+        if time.time() - os.path.getmtime(taken) < REPORT_JOB_TIMEOUT:
+            try:
+                os.link(taken, pending)
+            except OSError:
+                pass  # Уже есть новый маркер — рендерит его владелец
+    finally:
+        os.remove(taken)
+
+
+def submit_booked_report(booked_items, generated_at, catalog_version):
+    """
+    Ставит отчёт по набору броней в очередь, если его нет в кэше.
+
+    catalog_version — версия каталога, прочитанная до выборки броней.
+    Возвращает (job_id, status).
+    """
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    job_id = booked_set_key(booked_items, catalog_version)
+    status = job_status(job_id)
+    if status in ("done", "pending"):
+        return job_id, status
+
+    # Новый маркер создаётся атомарно: из двух одновременных запросов рендерит только один
+    _remove_stale_marker(job_id)
+    try:
+        fd = os.open(_path(job_id, "pending"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        os.close(fd)
+    except FileExistsError:
+        return job_id, "pending"
+    try:
+        os.remove(_path(job_id, "error"))
+    except OSError:
+        pass
+
+    items = [{"name": item["name"], "price": item["price"]} for item in booked_items]
+    try:
+        future = _executor.get().submit(render_booked_pdf_to_file, items, _path(job_id, "pdf"), generated_at)
+    except Exception:
+        os.remove(_path(job_id, "pending"))
+        raise
+    future.add_done_callback(lambda f: _on_done(job_id, f))
+    return job_id, "pending"
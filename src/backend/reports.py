@@ -0,0 +1,185 @@
+# backend/reports.py
+"""
+Генерация PDF-отчёта по забронированным товарам.
+
+Шрифт регистрируется в ReportLab один раз на процесс, стили создаются
+один раз и дальше только читаются. warm_up() можно вызвать при старте
+воркера, чтобы первый запрос отчёта не платил за разбор TTF-файла.
+"""
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+# Путь к шрифту считается от этого файла, а не от текущей директории процесса
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DejaVuSans.ttf')
+FONT_NAME = 'DejaVu'
+FALLBACK_FONT_NAME = 'Helvetica'  # Без DejaVu кириллица может отображаться некорректно
+
+COL_WIDTHS = [4.5*inch, 1.5*inch]
+CELL_PADDING = 6  # Отступ ячейки Table слева и справа по умолчанию, pt
+
+# Больше стольких строк — таблица собирается кусками из простых строк
+REPORT_CHUNKED_THRESHOLD = int(os.getenv("REPORT_CHUNKED_THRESHOLD", "500"))
+REPORT_TABLE_CHUNK_ROWS = int(os.getenv("REPORT_TABLE_CHUNK_ROWS", "40"))
+# До этого размера PDF собирается в памяти, дальше — во временном файле
+REPORT_SPOOL_MAX_BYTES = int(os.getenv("REPORT_SPOOL_MAX_BYTES", str(4 * 1024 * 1024)))
+
+ReportStyles = namedtuple('ReportStyles', ['font_name', 'normal', 'title', 'table', 'chunked_table'])
+
+_styles = None
+_styles_lock = threading.Lock()
+
+
+def _register_font():
+    """Регистрирует DejaVu (один раз) и возвращает имя шрифта для отчёта."""
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return FONT_NAME
+    try:
+        pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+        print(f"Successfully registered font {FONT_PATH}")
+        return FONT_NAME
+    except Exception as e:
+        print(f"WARNING: Could not register font {FONT_PATH}. Cyrillic text might render incorrectly. Error: {e}")
+        return FALLBACK_FONT_NAME
+
+
+def _build_styles(font_name):
+    sample = getSampleStyleSheet()
+    # Собственные стили вместо изменения общих sample-стилей ReportLab
+    normal = ParagraphStyle(
+        name='ReportNormal',
+        parent=sample['Normal'],
+        fontName=font_name
+    )
+    title = ParagraphStyle(
+        name='PdfTitle',
+        parent=normal,
+        fontSize=16,
+        alignment=1,
+        spaceAfter=14
+    )
+    table = TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.grey),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('FONTNAME', (0,0), (-1,0), font_name),
+        ('BOTTOMPADDING', (0,0), (-1,0), 12),
+        ('BACKGROUND', (0,1), (-1,-1), colors.beige),
+        ('GRID', (0,0), (-1,-1), 1, colors.black)
+    ])
+    # В таблицах-кусках ячейки — обычные строки, поэтому шрифт задаётся для всей таблицы
+    chunked_table = TableStyle(list(table.getCommands()) + [
+        ('FONTNAME', (0,1), (-1,-1), font_name),
+        ('FONTSIZE', (0,1), (-1,-1), normal.fontSize),
+    ])
+    return ReportStyles(font_name, normal, title, table, chunked_table)
+
+
+def get_styles():
+    """Стили отчёта; создаются при первом обращении и дальше не меняются."""
+    global _styles
+    if _styles is None:
+        with _styles_lock:
+            if _styles is None:
+                _styles = _build_styles(_register_font())
+    return _styles
+
+
+def warm_up():
+    """Хук для старта процесса: заранее регистрирует шрифт и собирает стили."""
+    get_styles()
+
+
+def _classic_table(booked_items, styles):
+    """Одна таблица, каждая ячейка — Paragraph (как раньше; для небольших отчётов)."""
+    data = [['Название', 'Цена (руб.)']]
+    for item in booked_items:
+        price_str = str(item['price']) if item['price'] is not None else 'N/A'
+        data.append([
+            # Paragraph разбирает разметку, поэтому название экранируем
+            Paragraph(escape(item['name']), styles.normal),
+            Paragraph(price_str, styles.normal)
+        ])
+    table = Table(data, colWidths=COL_WIDTHS)
+    table.setStyle(styles.table)
+    return [table]
+
+
+def _chunked_tables(booked_items, styles):
+    """
+    Таблицы по REPORT_TABLE_CHUNK_ROWS строк с повторяющимся заголовком.
+
+    Разбивка таблицы в ReportLab растёт сверхлинейно с числом строк,
+    поэтому большая таблица собирается из независимых кусков. Ячейки —
+    обычные строки; Paragraph (с переносом) только для названий, которые
+    не помещаются в колонку.
+    """
+    name_limit = COL_WIDTHS[0] - 2 * CELL_PADDING
+    font_size = styles.normal.fontSize
+    tables = []
+    for start in range(0, len(booked_items), REPORT_TABLE_CHUNK_ROWS):
+        data = [['Название', 'Цена (руб.)']]
+        for item in booked_items[start:start + REPORT_TABLE_CHUNK_ROWS]:
+            name = item['name']
+            if pdfmetrics.stringWidth(name, styles.font_name, font_size) > name_limit:
+                name = Paragraph(escape(name), styles.normal)
+            data.append([name, str(item['price']) if item['price'] is not None else 'N/A'])
+        table = Table(data, colWidths=COL_WIDTHS, repeatRows=1)
+        table.setStyle(styles.chunked_table)
+        tables.append(table)
+    return tables
+
+
+def render_booked_pdf(booked_items, generated_at=None, output=None, chunked=None):
+    """
+    Собирает PDF со списком забронированных товаров.
+
+    booked_items — строки с ключами 'name' и 'price'. PDF пишется в output
+    (файловый объект); по умолчанию это SpooledTemporaryFile, который уходит
+    на диск после REPORT_SPOOL_MAX_BYTES. chunked=None выбирает режим по
+    размеру списка (см. REPORT_CHUNKED_THRESHOLD). Возвращает output,
+    установленный на начало.
+    """
+    styles = get_styles()
+    generated_at = generated_at or datetime.now()
+    if chunked is None:
+        chunked = len(booked_items) > REPORT_CHUNKED_THRESHOLD
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_MAX_BYTES)
+
+    doc = SimpleDocTemplate(output, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
+
+    story = [Paragraph("Список забронированных товаров", styles.title)]
+    story.extend(_chunked_tables(booked_items, styles) if chunked else _classic_table(booked_items, styles))
+    story.append(Spacer(1, 0.2*inch))
+    story.append(Paragraph(f"Отчет сгенерирован: {generated_at.strftime('%Y-%m-%d %H:%M:%S')}", styles.normal))
+
+    doc.build(story)
+    output.seek(0)
+    return output
+
+
+def render_booked_pdf_to_file(booked_items, path, generated_at=None):
+    """
+    Рендерит отчёт в файл (для фонового пула процессов).
+
+    Файл пишется во временный и переименовывается, поэтому читатели
+    никогда не видят недописанный PDF.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        render_booked_pdf(booked_items, generated_at=generated_at, output=f)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,94 @@
+import os
+import threading
+
+import psycopg2
+import pytest
+
+import db
+from db import DatabaseUnavailable, close_pool, get_db_connection
+from migrate import run_migrations
+
+BOOKING_THREADS = 30
+# Отдельная БД для тестов с настоящим PostgreSQL (сервер и пользователь — из DB_*).
+# Тест её мигрирует и пишет в неё, поэтому рабочая DB_NAME не используется никогда.
+TEST_DB_NAME = os.getenv("TEST_DB_NAME")
+
+
+@pytest.fixture
+def live_db(monkeypatch):
+    """Пул get_db_connection() переключается на TEST_DB_NAME; без неё тест пропускается."""
+    if not TEST_DB_NAME:
+        pytest.skip("TEST_DB_NAME не задана: тесты с настоящей БД выключены")
+    if TEST_DB_NAME == db.DB_NAME:
+        pytest.skip("TEST_DB_NAME совпадает с DB_NAME: рабочую БД тесты не трогают")
+    close_pool()
+    monkeypatch.setattr(db, "DB_NAME", TEST_DB_NAME)
+    monkeypatch.setattr(db, "DB_REPLICA_HOSTS", [])
+    try:
+        with get_db_connection() as conn:
+            run_migrations(conn)
+    except (DatabaseUnavailable, psycopg2.Error) as e:
+        close_pool()
+        pytest.skip(f"PostgreSQL недоступен: {e}")
+    yield
+    close_pool()
+
+
+@pytest.fixture
+def live_product(live_db):
+    """Отдельный товар в TEST_DB_NAME (удаляется после теста)."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO products (name, price) VALUES (%s, %s) RETURNING id",
+                ("Тест гонки бронирований", 100)
+            )
+            product_id = cur.fetchone()[0]
+        conn.commit()
+    yield product_id
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM products WHERE id = %s", (product_id,))
+        conn.commit()
+
+
+def _race(app, path, threads):
+    """Одновременно отправляет PUT path из threads потоков; возвращает коды ответов."""
+    barrier = threading.Barrier(threads)
+    statuses = []
+    lock = threading.Lock()
+
+    def put():
+        client = app.test_client()
+        barrier.wait()
+        status = client.put(path).status_code
+        with lock:
+            statuses.append(status)
+
+    workers = [threading.Thread(target=put) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sorted(statuses)
+
+
+def test_concurrent_booking_has_single_winner(app, live_product):
+    statuses = _race(app, f'/api/products/{live_product}/book', BOOKING_THREADS)
+    assert statuses == [200] + [409] * (BOOKING_THREADS - 1)
+
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT is_booked FROM products WHERE id = %s", (live_product,))
+        assert cur.fetchone()[0] is True
+
+
+def test_concurrent_unbooking_has_single_winner(app, live_product):
+    client = app.test_client()
+    assert client.put(f'/api/products/{live_product}/book').status_code == 200
+
+    statuses = _race(app, f'/api/products/{live_product}/unbook', BOOKING_THREADS)
+    assert statuses == [200] + [409] * (BOOKING_THREADS - 1)
+
+
+def test_booking_missing_product_is_not_found(client, live_product):
+    response = client.put(f'/api/products/{live_product + 1000000}/book')
+    assert response.status_code == 404
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+import thumbnails
+from thumbnails import ThumbnailError, get_thumbnail, url_version
+
+
+@pytest.fixture
+def thumbnail_env(tmp_path, monkeypatch):
+    """Кэш и каталог исходников во временной папке; свежий пул процессов на тест."""
+    source_root = tmp_path / "images"
+    source_root.mkdir()
+    cache_dir = tmp_path / "cache"
+    # Переменные окружения — для процессов пула, если они не наследуют память родителя (forkserver/spawn)
+    monkeypatch.setenv("THUMBNAIL_LOCAL_ROOT", str(source_root))
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_LOCAL_ROOT", str(source_root))
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_CACHE_DIR", str(cache_dir))
+    _shutdown_executor()
+    yield source_root, cache_dir
+    _shutdown_executor()
+
+
+def _shutdown_executor():
+    executor = thumbnails._executor.pop()
+    if executor is not None:
+        executor.shutdown()
+
+
+@pytest.fixture
+def source_image(thumbnail_env):
+    """Локальная картинка 800x600 внутри THUMBNAIL_LOCAL_ROOT; возвращает её image_url."""
+    image_module = pytest.importorskip("PIL.Image")
+    source_root, _ = thumbnail_env
+    image_module.new("RGB", (800, 600), (200, 30, 30)).save(source_root / "ring.png")
+    return "ring.png"
+
+
+def _loader(image_url):
+    calls = []
+
+    def load():
+        calls.append(image_url)
+        return image_url
+    return load, calls
+
+
+def test_renders_thumbnail_and_serves_it_from_cache(source_image):
+    from PIL import Image
+
+    load, calls = _loader(source_image)
+    path, digest, version = get_thumbnail(1, None, "s", "jpeg", load)
+
+    assert version == url_version(source_image)
+    with open(path, "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() == digest
+    with Image.open(path) as thumbnail:
+        assert thumbnail.format == "JPEG"
+        assert max(thumbnail.size) == thumbnails.THUMBNAIL_SIZES["s"]
+
+    # С актуальной версией миниатюра берётся с диска без обращения к БД
+    cached = get_thumbnail(1, version, "s", "jpeg", load)
+    assert cached == (path, digest, version)
+    assert calls == [source_image]
+
+
+def test_identical_images_share_cached_content(source_image):
+    first = get_thumbnail(1, None, "m", "jpeg", _loader(source_image)[0])
+    second = get_thumbnail(2, None, "m", "jpeg", _loader(source_image)[0])
+    assert first[:2] == second[:2]
+
+
+def test_stale_version_returns_current_version(source_image):
+    _, _, version = get_thumbnail(1, "000000000000", "s", "jpeg", _loader(source_image)[0])
+    assert version == url_version(source_image)
+
+
+def test_product_without_image_is_lookup_error(thumbnail_env):
+    with pytest.raises(LookupError):
+        get_thumbnail(1, None, "s", "jpeg", lambda: None)
+
+
+def test_source_outside_local_root_is_rejected(thumbnail_env):
+    with pytest.raises(ThumbnailError):
+        thumbnails._read_source("../../etc/passwd")
+
+
+def test_corrupt_source_is_thumbnail_error(thumbnail_env):
+    pytest.importorskip("PIL")
+    source_root, _ = thumbnail_env
+    (source_root / "broken.jpg").write_bytes(b"not an image")
+    with pytest.raises(ThumbnailError):
+        get_thumbnail(1, None, "s", "jpeg", lambda: "broken.jpg")
+
+
+def test_evict_removes_least_recently_used_files(thumbnail_env, monkeypatch):
+    _, cache_dir = thumbnail_env
+    content_dir = cache_dir / "content"
+    content_dir.mkdir(parents=True)
+    (cache_dir / "refs").mkdir()
+    now = time.time()
+    for age in range(10):
+        path = content_dir / f"{age}.jpeg"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (now - age * 60, now - age * 60))
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_CACHE_MAX_BYTES", 500)
+
+    thumbnails._evict()
+
+    # Остаются самые свежие файлы, суммарно не больше 90% лимита
+    assert sorted(p.name for p in content_dir.iterdir()) == ["0.jpeg", "1.jpeg", "2.jpeg", "3.jpeg"]
+
+
+def test_cache_hit_refreshes_last_use(thumbnail_env):
+    _, cache_dir = thumbnail_env
+    (cache_dir / "content").mkdir(parents=True)
+    (cache_dir / "refs").mkdir()
+    ref_path = thumbnails._ref_path(1, "v1", "s", "jpeg")
+    content_path = thumbnails._content_path("abc", "jpeg")
+    with open(content_path, "wb") as f:
+        f.write(b"thumb")
+    with open(ref_path, "w", encoding="ascii") as f:
+        f.write("abc")
+    old = time.time() - 3600
+    os.utime(content_path, (old, old))
+
+    assert thumbnails._cached(ref_path, "jpeg") == (content_path, "abc")
+    assert os.path.getmtime(content_path) > old + 1800
+
+
+def test_missing_ref_is_cache_miss(thumbnail_env):
+    assert thumbnails._cached(thumbnails._ref_path(1, "v1", "s", "jpeg"), "jpeg") is None
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/image.jpg",
+    "http://localhost:8080/image.jpg",
+    "http://10.0.0.5/image.jpg",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/image.jpg",
+    "http://[::ffff:192.168.1.1]/image.jpg",
+])
+def test_internal_addresses_are_not_fetched(url):
+    with pytest.raises(ThumbnailError):
+        thumbnails._read_source(url)
+
+
+def test_hosts_outside_allowlist_are_not_fetched(monkeypatch):
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_ALLOWED_HOSTS", ["images.example.com"])
+    with pytest.raises(ThumbnailError):
+        thumbnails._read_source("https://attacker.example.net/image.jpg")
+    # Поддомены разрешённого хоста проходят проверку хоста
+    thumbnails._check_host("cdn.images.example.com")
+
+
+def test_redirects_are_not_followed():
+    handler = thumbnails._NoRedirectHandler()
+    assert handler.redirect_request(None, None, 302, "Found", {}, "http://127.0.0.1/") is None
+
+
+def test_thumbnail_route_unknown_product_is_404(client, mock_db):
+    mock_db['cursor'].fetchone.return_value = None
+    response = client.get('/api/products/999/thumbnail')
+    assert response.status_code == 404
+
+
+def test_thumbnail_route_product_without_image_is_404(client, mock_db):
+    mock_db['cursor'].fetchone.return_value = (None,)
+    response = client.get('/api/products/1/thumbnail')
+    assert response.status_code == 404
+
+
+def test_thumbnail_route_rejects_unknown_size(client):
+    response = client.get('/api/products/1/thumbnail?size=xl')
+    assert response.status_code == 400
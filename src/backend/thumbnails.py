@@ -0,0 +1,319 @@
+# backend/thumbnails.py
+"""
+Миниатюры изображений товаров с дисковым кэшем.
+
+Исходное изображение (products.image_url) скачивается или читается один
+раз, миниатюра фиксированного размера (WebP или JPEG) рендерится в пуле
+процессов через Pillow. Кэш в THUMBNAIL_CACHE_DIR адресуется содержимым:
+
+    content/<sha256>.<ext>     — байты миниатюры; одинаковые картинки хранятся один раз
+    refs/<ключ>                — ключ (товар, версия URL, размер, формат) -> sha256
+
+sha256 миниатюры служит ETag. Суммарный размер кэша ограничен
+THUMBNAIL_CACHE_MAX_BYTES: при превышении удаляются давно не
+использованные файлы (время использования — mtime, обновляется при выдаче).
+
+Версия URL (первые 12 символов md5 от image_url) входит в адрес миниатюры,
+поэтому после смены картинки у товара меняется и адрес — ответы можно
+кэшировать в браузере «навсегда».
+
+Источник — http(s)-URL или, для локальной разработки и тестов, путь к
+файлу внутри THUMBNAIL_LOCAL_ROOT (если задан). Скачивание идёт только
+на публичные адреса (не loopback, не частные сети, не link-local — так
+бэкенд нельзя заставить обратиться к внутренним сервисам), без прокси и
+без перенаправлений; THUMBNAIL_ALLOWED_HOSTS дополнительно ограничивает
+список хостов.
+"""
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import urlparse
+
+from process_local import ProcessLocal
+
+THUMBNAIL_CACHE_DIR = os.getenv(
+    "THUMBNAIL_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "lombard_thumbnails")
+)
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+THUMBNAIL_TIMEOUT = float(os.getenv("THUMBNAIL_TIMEOUT", "15"))  # сек. на скачивание и рендеринг
+THUMBNAIL_SOURCE_MAX_BYTES = int(os.getenv("THUMBNAIL_SOURCE_MAX_BYTES", str(20 * 1024 * 1024)))
+THUMBNAIL_LOCAL_ROOT = os.getenv("THUMBNAIL_LOCAL_ROOT")  # Каталог с локальными исходниками (тесты, разработка)
+# "images.example.com,cdn.example.net": хост или его поддомены; пусто — любой публичный хост
+THUMBNAIL_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.getenv("THUMBNAIL_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+
+# Размер — сторона квадрата, в который вписывается миниатюра (пропорции сохраняются)
+THUMBNAIL_SIZES = {"s": 160, "m": 320}
+THUMBNAIL_DEFAULT_SIZE = "m"
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+SOURCE_MAX_PIXELS = 50_000_000  # Защита от «бомб» с огромным разрешением
+
+# Адрес миниатюры для строки products (используется в SQL каталога и поиска)
+THUMBNAIL_URL_SQL = (
+    "CASE WHEN image_url IS NOT NULL "
+    "THEN '/api/products/' || id || '/thumbnail?v=' || left(md5(image_url), 12) END"
+)
+
+
+class ThumbnailError(Exception):
+    """Исходное изображение недоступно или не является картинкой."""
+
+
+def url_version(image_url):
+    """Версия адреса миниатюры — совпадает с left(md5(image_url), 12) в THUMBNAIL_URL_SQL."""
+    return hashlib.md5(image_url.encode("utf-8")).hexdigest()[:12]
+
+
+def _check_address(address):
+    """Разрешены только публичные адреса: иначе URL товара открывал бы доступ во внутреннюю сеть."""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    if not ip.is_global or ip.is_multicast:
+        raise ThumbnailError(f"Адрес изображения недоступен для скачивания: {ip}")
+
+
+def _check_host(host):
+    host = (host or "").lower().rstrip(".")
+    if not host:
+        raise ThumbnailError("В адресе изображения нет хоста")
+    if THUMBNAIL_ALLOWED_HOSTS and not any(
+        host == allowed or host.endswith("." + allowed) for allowed in THUMBNAIL_ALLOWED_HOSTS
+    ):
+        raise ThumbnailError(f"Хост изображения не входит в THUMBNAIL_ALLOWED_HOSTS: {host}")
+
+
+def _create_checked_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None, **kwargs):
+    """
+    socket.create_connection, который проверяет все адреса хоста до подключения.
+
+    Подключение идёт к уже проверенному IP, поэтому повторное разрешение
+    имени (DNS rebinding) не подменит адрес.
+    """
+    host, port = address
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for info in infos:
+        _check_address(info[4][0])
+    return socket.create_connection((infos[0][4][0], port), timeout, source_address)
+
+
+class _CheckedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _create_checked_connection
+
+
+class _CheckedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _create_checked_connection
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_CheckedHTTPConnection, req)
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_CheckedHTTPSConnection, req, context=self._context)
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Перенаправления не выполняются: ответ 3xx становится ошибкой."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+# Без ProxyHandler из окружения: проверяется адрес самого источника, а не прокси
+_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _CheckedHTTPHandler, _CheckedHTTPSHandler, _NoRedirectHandler
+)
+
+
+def _read_source(image_url):
+    """Байты исходного изображения (не больше THUMBNAIL_SOURCE_MAX_BYTES)."""
+    parsed = urlparse(image_url)
+    scheme = parsed.scheme
+    if scheme in ("http", "https"):
+        _check_host(parsed.hostname)
+        request = urllib.request.Request(image_url, headers={"User-Agent": "lombard-thumbnailer"})
+        with _opener.open(request, timeout=THUMBNAIL_TIMEOUT) as response:
+            data = response.read(THUMBNAIL_SOURCE_MAX_BYTES + 1)
+    elif THUMBNAIL_LOCAL_ROOT and scheme in ("", "file"):
+        root = os.path.realpath(THUMBNAIL_LOCAL_ROOT)
+        path = os.path.realpath(os.path.join(root, urlparse(image_url).path.lstrip("/")))
+        # Только файлы внутри THUMBNAIL_LOCAL_ROOT
+        if os.path.commonpath([root, path]) != root:
+            raise ThumbnailError("Путь к изображению вне THUMBNAIL_LOCAL_ROOT")
+        with open(path, "rb") as f:
+            data = f.read(THUMBNAIL_SOURCE_MAX_BYTES + 1)
+    else:
+        raise ThumbnailError(f"Неподдерживаемый источник изображения: {scheme or 'локальный файл'}")
+    if len(data) > THUMBNAIL_SOURCE_MAX_BYTES:
+        raise ThumbnailError("Исходное изображение слишком большое")
+    return data
+
+
+def render_thumbnail(image_url, size, fmt):
+    """Скачивает исходник и возвращает байты миниатюры (выполняется в пуле процессов)."""
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = SOURCE_MAX_PIXELS
+    pil_format, _, save_options = THUMBNAIL_FORMATS[fmt]
+    try:
+        with Image.open(io.BytesIO(_read_source(image_url))) as image:
+            image.draft("RGB", (size, size))  # JPEG декодируется сразу в уменьшенном масштабе
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            if pil_format == "JPEG" and image.mode == "RGBA":
+                # У JPEG нет прозрачности — кладём на белый фон
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            image.thumbnail((size, size), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, pil_format, **save_options)
+    except (OSError, Image.DecompressionBombError, ValueError) as e:
+        raise ThumbnailError(f"Не удалось обработать изображение: {e}")
+    return output.getvalue()
+
+
+_executor = ProcessLocal(lambda: ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS))
+# Ключ ref -> Future: одновременные промахи по одной миниатюре рендерятся один раз
+# (свой словарь у каждого процесса: Future родителя после fork не завершится)
+_inflight = ProcessLocal(dict)
+_inflight_lock = threading.Lock()
+_written_since_evict = 0
+
+
+def _ref_path(product_id, version, size, fmt):
+    return os.path.join(THUMBNAIL_CACHE_DIR, "refs", f"{product_id}-{version}-{size}.{fmt}")
+
+
+def _content_path(digest, fmt):
+    return os.path.join(THUMBNAIL_CACHE_DIR, "content", f"{digest}.{fmt}")
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _cached(ref_path, fmt):
+    """(путь, sha256) готовой миниатюры или None; отмечает её как использованную."""
+    try:
+        with open(ref_path, encoding="ascii") as f:
+            digest = f.read().strip()
+        path = _content_path(digest, fmt)
+        os.utime(path)  # mtime = время последнего использования (для LRU)
+        os.utime(ref_path)
+        return path, digest
+    except OSError:
+        # Ссылки нет или содержимое уже вытеснено
+        return None
+
+
+def _evict():
+    """Удаляет давно не использованные файлы, пока кэш больше THUMBNAIL_CACHE_MAX_BYTES."""
+    entries = []
+    total = 0
+    for subdir in ("content", "refs"):
+        try:
+            for entry in os.scandir(os.path.join(THUMBNAIL_CACHE_DIR, subdir)):
+                if entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        except OSError:
+            continue
+    if total <= THUMBNAIL_CACHE_MAX_BYTES:
+        return
+    entries.sort()
+    # Освобождаем с запасом в 10%, чтобы не сканировать каталог на каждой записи
+    target = THUMBNAIL_CACHE_MAX_BYTES * 0.9
+    for _, file_size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= file_size
+        except OSError:
+            pass
+
+
+def _store(ref_path, fmt, data):
+    global _written_since_evict
+    digest = hashlib.sha256(data).hexdigest()
+    path = _content_path(digest, fmt)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    _write_atomic(ref_path, digest.encode("ascii"))
+    _written_since_evict += len(data)
+    if _written_since_evict > THUMBNAIL_CACHE_MAX_BYTES // 100:
+        _written_since_evict = 0
+        _evict()
+    return path, digest
+
+
+def get_thumbnail(product_id, version, size, fmt, load_image_url):
+    """
+    Миниатюра товара из кэша или после рендеринга: (путь, sha256, версия URL).
+
+    version — версия из адреса миниатюры (или None). При попадании в кэш
+    БД не нужна; при промахе image_url берётся через load_image_url().
+    Если картинку товара успели сменить, рендерится актуальная, и
+    возвращённая версия отличается от запрошенной.
+    Бросает ThumbnailError, LookupError (нет изображения) или TimeoutError.
+    """
+    if version is not None:
+        cached = _cached(_ref_path(product_id, version, size, fmt), fmt)
+        if cached:
+            return cached + (version,)
+
+    image_url = load_image_url()
+    if not image_url:
+        raise LookupError("У товара нет изображения")
+    current_version = url_version(image_url)
+    ref_path = _ref_path(product_id, current_version, size, fmt)
+    if current_version != version:
+        cached = _cached(ref_path, fmt)
+        if cached:
+            return cached + (current_version,)
+    os.makedirs(os.path.join(THUMBNAIL_CACHE_DIR, "content"), exist_ok=True)
+    os.makedirs(os.path.join(THUMBNAIL_CACHE_DIR, "refs"), exist_ok=True)
+
+    executor = _executor.get()
+    inflight = _inflight.get()
+    with _inflight_lock:
+        future = inflight.get(ref_path)
+        owner = future is None
+        if owner:
+            future = executor.submit(render_thumbnail, image_url, THUMBNAIL_SIZES[size], fmt)
+            inflight[ref_path] = future
+            future.add_done_callback(lambda _: inflight.pop(ref_path, None))
+    try:
+        data = future.result(timeout=THUMBNAIL_TIMEOUT)
+    except FutureTimeoutError:
+        raise TimeoutError("Миниатюра не успела сгенерироваться")
+    # Файл записывает запрос-владелец; остальные берут готовый или пишут сами (запись атомарная)
+    stored = _store(ref_path, fmt, data) if owner else (_cached(ref_path, fmt) or _store(ref_path, fmt, data))
+    return stored + (current_version,)
@@ -0,0 +1,103 @@
+# backend/tokens.py
+"""
+Подписанные токены доступа (JWT, HS256) без обращения к базе данных.
+
+Токен несёт id пользователя и роль и проверяется целиком в памяти:
+HMAC-SHA256 по секрету AUTH_SECRET_KEY и срок действия.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from functools import wraps
+
+from flask import g, jsonify, request
+
+AUTH_SECRET_KEY = os.getenv("AUTH_SECRET_KEY")
+AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", str(8 * 3600)))  # сек.
+MAX_TOKEN_LENGTH = 1024  # Более длинные заголовки отбрасываются без разбора
+
+if not AUTH_SECRET_KEY:
+    print("WARNING: AUTH_SECRET_KEY is not set. Using a random key: tokens will not survive a restart "
+          "and will not be accepted by other worker processes.")
+    AUTH_SECRET_KEY = base64.urlsafe_b64encode(os.urandom(32)).decode("ascii")
+
+_SECRET = AUTH_SECRET_KEY.encode("utf-8")
+_HEADER = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+
+
+class InvalidToken(Exception):
+    """Токен отсутствует, подделан или истёк."""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _sign(signing_input):
+    return _b64encode(hmac.new(_SECRET, signing_input, hashlib.sha256).digest())
+
+
+def issue_token(user_id, role):
+    """Выпускает токен для пользователя; возвращает (токен, срок жизни в секундах)."""
+    now = int(time.time())
+    payload = {"sub": str(user_id), "role": role, "iat": now, "exp": now + AUTH_TOKEN_TTL}
+    signing_input = _HEADER + b"." + _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return (signing_input + b"." + _sign(signing_input)).decode("ascii"), AUTH_TOKEN_TTL
+
+
+def verify_token(token):
+    """Проверяет подпись и срок действия; возвращает claims или бросает InvalidToken."""
+    # Дешёвые проверки формы до любых вычислений
+    if not token or len(token) > MAX_TOKEN_LENGTH or token.count(".") != 2:
+        raise InvalidToken("Некорректный токен")
+    raw = token.encode("ascii", errors="ignore")
+    signing_input, _, signature = raw.rpartition(b".")
+    header, _, payload = signing_input.partition(b".")
+    if header != _HEADER:
+        raise InvalidToken("Некорректный токен")
+    if not hmac.compare_digest(signature, _sign(signing_input)):
+        raise InvalidToken("Неверная подпись токена")
+    try:
+        claims = json.loads(_b64decode(payload))
+        expires_at = int(claims["exp"])
+        claims["user_id"] = int(claims["sub"])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidToken("Некорректный токен")
+    if expires_at < time.time():
+        raise InvalidToken("Срок действия токена истек")
+    return claims
+
+
+def _bearer_token():
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else None
+
+
+def require_role(*roles):
+    """
+    Декоратор маршрута: пускает только с валидным токеном нужной роли.
+
+    Проверка идёт до тела обработчика и без запросов к БД: 401 — нет или
+    плохой токен, 403 — роль не подходит. Claims доступны в g.auth.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                claims = verify_token(_bearer_token())
+            except InvalidToken as e:
+                return jsonify({"message": f"Требуется авторизация: {e}"}), 401
+            if roles and claims.get("role") not in roles:
+                return jsonify({"message": "Недостаточно прав"}), 403
+            g.auth = claims
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
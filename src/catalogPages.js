@@ -0,0 +1,38 @@
+// Постраничная загрузка каталога (бэкенд: GET /api/products с limit и cursor)
+import axios from 'axios';
+import config from './config';
+
+// Размер страницы при подгрузке
+export const PAGE_SIZE = 50;
+// Наибольший limit, который принимает сервер (PRODUCTS_PAGE_MAX в app.py)
+const PAGE_MAX = 500;
+
+// Загружает одну страницу. params — фильтры (например, { is_booked: true }),
+// cursor — next_cursor предыдущей страницы или null для первой.
+// Возвращает { items, nextCursor }; nextCursor === null — страниц больше нет.
+export async function fetchCatalogPage(params, cursor, limit = PAGE_SIZE) {
+  const response = await axios.get(`${config.API_URL}/api/products`, {
+    params: { ...params, limit, ...(cursor !== null ? { cursor } : {}) }
+  });
+  return { items: response.data.items, nextCursor: response.data.next_cursor };
+}
+
+// limit для перечитывания списка, в котором уже загружено loadedCount товаров:
+// не меньше одной страницы и не больше, чем разрешает сервер (остальное подгрузится кнопкой)
+export function reloadLimit(loadedCount) {
+  return Math.min(Math.max(loadedCount, PAGE_SIZE), PAGE_MAX);
+}
+
+// Добавляет страницу в конец списка, пропуская товары, которые уже пришли живыми событиями
+export function appendPage(list, items) {
+  const known = new Set(list.map(i => i.id));
+  items.forEach(item => {
+    if (!known.has(item.id)) list.push(item);
+  });
+}
+
+// Попадает ли товар в уже загруженные страницы (каталог упорядочен по id).
+// Товары дальше курсора придут вместе со своей страницей.
+export function isLoaded(product, nextCursor) {
+  return nextCursor === null || product.id <= nextCursor;
+}
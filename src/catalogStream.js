@@ -0,0 +1,63 @@
+// Живые обновления каталога через Server-Sent Events (бэкенд: /api/products/stream)
+import config from './config';
+
+// Если сервер не держит поток (503: режим воркеров sync или лимит подписчиков),
+// каталог перечитывается раз в POLL_INTERVAL_MS
+const POLL_INTERVAL_MS = 30000;
+
+// Подписка на изменения каталога. onEvent(type, product) — для insert / update / delete,
+// onReload() — когда изменений слишком много или часть событий могла потеряться.
+// Возвращает функцию для отписки.
+export function subscribeCatalog(onEvent, onReload) {
+  const source = new EventSource(`${config.API_URL}/api/products/stream`);
+  let pollTimer = null;
+  ['insert', 'update', 'delete'].forEach(type => {
+    source.addEventListener(type, (event) => {
+      const product = JSON.parse(event.data).product;
+      // Слишком длинная строка приходит только с id — перечитываем каталог целиком
+      if (type !== 'delete' && Object.keys(product).length === 1) {
+        onReload();
+        return;
+      }
+      onEvent(type, product);
+    });
+  });
+  source.addEventListener('reload', () => onReload());
+
+  // EventSource переподключается сам; события за время разрыва не приходят, поэтому перечитываем
+  let wasDisconnected = false;
+  source.onerror = () => {
+    if (source.readyState === EventSource.CLOSED) {
+      // Ответ не text/event-stream (например, 503): EventSource больше не переподключается
+      source.close();
+      if (!pollTimer) pollTimer = setInterval(onReload, POLL_INTERVAL_MS);
+      return;
+    }
+    wasDisconnected = true;
+  };
+  source.onopen = () => {
+    if (wasDisconnected) {
+      wasDisconnected = false;
+      onReload();
+    }
+  };
+  return () => {
+    source.close();
+    if (pollTimer) clearInterval(pollTimer);
+  };
+}
+
+// Применяет событие к списку товаров. belongs(product) — должен ли товар быть в этом списке
+// (например, корзина показывает только забронированные).
+export function applyProductEvent(list, type, product, belongs = () => true) {
+  const index = list.findIndex(i => i.id === product.id);
+  if (type === 'delete' || !belongs(product)) {
+    if (index !== -1) list.splice(index, 1);
+    return;
+  }
+  if (index !== -1) {
+    list[index] = { ...list[index], ...product };
+  } else {
+    list.push(product);
+  }
+}
@@ -1,9 +1,38 @@
 import './assets/main.css' // Если у вас есть базовые стили
 
 import { createApp } from 'vue'
+import axios from 'axios'
 import App from './App.vue'
 import router from './router' // Импортируем настроенный роутер
 
+// Позиция последней записи этого клиента в БД (заголовок X-DB-Position).
+// Пока она отправляется, сервер не читает для клиента с отстающей реплики;
+// через DB_POSITION_TTL_MS реплики её заведомо догнали — перестаём отправлять
+const DB_POSITION_KEY = 'db_position'
+const DB_POSITION_TTL_MS = 60000
+
+// Добавляем токен доступа, полученный при входе, ко всем запросам к API
+axios.interceptors.request.use((requestConfig) => {
+  const token = localStorage.getItem('auth_token')
+  if (token) {
+    requestConfig.headers.Authorization = `Bearer ${token}`
+  }
+  const saved = JSON.parse(sessionStorage.getItem(DB_POSITION_KEY) || 'null')
+  if (saved && Date.now() - saved.at < DB_POSITION_TTL_MS) {
+    requestConfig.headers['X-DB-Position'] = saved.position
+  }
+  return requestConfig
+})
+
+// Запоминаем позицию, которую сервер вернул после записи
+axios.interceptors.response.use((response) => {
+  const position = response.headers['x-db-position']
+  if (position) {
+    sessionStorage.setItem(DB_POSITION_KEY, JSON.stringify({ position, at: Date.now() }))
+  }
+  return response
+})
+
 const app = createApp(App)
 
 app.use(router) // Подключаем роутер к приложению